@@ -0,0 +1,105 @@
+# bench_numeric_cleaning.py
+# Compare the legacy regexp_replace chain against the single-pass numeric parser
+# used in step 11 of scripts/glue_job_raw_to_processed.py.
+#
+# Usage (local PySpark):
+#   python benchmarks/bench_numeric_cleaning.py [--rows 2000000] [--repeat 3] [--decimal ,]
+#
+# The expression builders below mirror the Glue job; keep them in sync when the
+# parsing rules change.
+
+import argparse
+import re
+import time
+
+from pyspark.sql import SparkSession
+from pyspark.sql.functions import col, lit, when, regexp_replace, translate, rand, floor, concat, format_number, count, sum as sum_
+
+
+def legacy_clean(df):
+    def clean_currency(df, name):
+        df = df.withColumn(name, regexp_replace(col(name), "[^0-9()\\.-]", ""))
+        df = df.withColumn(name, regexp_replace(col(name), "[(]", "-"))
+        df = df.withColumn(name, regexp_replace(col(name), "[)]", ""))
+        return df.withColumn(name, col(name).cast("double"))
+
+    df = clean_currency(df, "unit_price")
+    df = clean_currency(df, "revenue")
+    return df.withColumn("quantity", regexp_replace(col("quantity"), "[^0-9-]", "").cast("int"))
+
+
+def single_pass_clean(df, decimal_sep="."):
+    thousands_sep = "." if decimal_sep == "," else ","
+    currency_chars = "$€£¥"
+    d, t = re.escape(decimal_sep), re.escape(thousands_sep)
+    grouped = f"(?:\\d{{1,3}}(?:{t}\\d{{3}})+|\\d+)"
+    amount = f"[{currency_chars}]?\\s*-?(?:{grouped}(?:{d}\\d+)?|{d}\\d+)\\s*[{currency_chars}]?"
+    decimal_pattern = f'^"?\\s*(?:-?\\s*{amount}|\\(\\s*{amount}\\s*\\))\\s*"?$'
+    integer_pattern = f'^"?\\s*-?{grouped}(?:{d}0+)?\\s*"?$'
+    translate_from = "(" + decimal_sep + thousands_sep + currency_chars + ') "'
+
+    def parse_number(name, pattern, dtype):
+        c = col(name)
+        return when(c.rlike(pattern), translate(c, translate_from, "-.").cast(dtype))
+
+    return df.select(
+        parse_number("unit_price", decimal_pattern, "double").alias("unit_price"),
+        parse_number("revenue", decimal_pattern, "double").alias("revenue"),
+        parse_number("quantity", integer_pattern, "int").alias("quantity"),
+    )
+
+
+def build_input(spark, rows, decimal_sep):
+    # Mix of plain, currency-prefixed, grouped and parenthesised values
+    base = spark.range(rows).withColumn("r", rand(42))
+    price = format_number(rand(7) * 5000, 2)
+    if decimal_sep == ",":
+        price = translate(price, ",.", ".,")
+    styled = (
+        when(col("r") < 0.7, price)
+        .when(col("r") < 0.85, concat(lit("$"), price))
+        .when(col("r") < 0.95, concat(lit("("), price, lit(")")))
+        .otherwise(lit("N/A"))
+    )
+    return base.select(
+        styled.alias("unit_price"),
+        styled.alias("revenue"),
+        (floor(rand(3) * 10)).cast("string").alias("quantity"),
+    ).cache()
+
+
+def run(label, df):
+    start = time.perf_counter()
+    stats = df.agg(
+        count(lit(1)).alias("rows"),
+        sum_(when(col("unit_price").isNull(), 1).otherwise(0)).alias("null_unit_price"),
+        sum_(col("revenue")).alias("revenue_total"),
+    ).collect()[0]
+    elapsed = time.perf_counter() - start
+    print(f"{label:<14} {elapsed:8.3f}s  rows={stats['rows']}  null_unit_price={stats['null_unit_price']}  revenue_total={stats['revenue_total']:.2f}")
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=2_000_000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--decimal", default=".", choices=[".", ","])
+    opts = parser.parse_args()
+
+    spark = SparkSession.builder.master("local[*]").appName("bench_numeric_cleaning").getOrCreate()
+    spark.sparkContext.setLogLevel("WARN")
+
+    df = build_input(spark, opts.rows, opts.decimal)
+    df.count()
+
+    print(f"[INFO] rows={opts.rows} decimal='{opts.decimal}' repeat={opts.repeat}")
+    legacy = min(run("legacy_regex", legacy_clean(df)) for _ in range(opts.repeat))
+    single = min(run("single_pass", single_pass_clean(df, opts.decimal)) for _ in range(opts.repeat))
+    print(f"[INFO] best legacy={legacy:.3f}s single_pass={single:.3f}s speedup={legacy / single:.2f}x")
+
+    spark.stop()
+
+
+if __name__ == "__main__":
+    main()
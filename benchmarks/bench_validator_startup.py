@@ -0,0 +1,195 @@
+# bench_validator_startup.py
+# Measure cold-start cost of scripts/lambda_validator.py locally: module import
+# time and first/second invocation latency, against stubbed S3/Glue/SNS endpoints.
+#
+# Usage:
+#   python benchmarks/bench_validator_startup.py [--runs 10] [--scenario valid|structural_reject|all]
+#
+# Every run starts a fresh Python process (a true cold start). All AWS calls go to
+# an in-process HTTP stub via AWS_ENDPOINT_URL, so numbers reflect client
+# construction, imports and request handling rather than network latency.
+# Requires boto3 >= 1.28 (AWS_ENDPOINT_URL support).
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+SCRIPTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "scripts")
+BUCKET = "bench-bucket"
+
+VALID_CSV = (
+    b"transaction_id,store_id,timestamp,item_id,item_category,quantity,unit_price,revenue,payment_method,customer_id\n"
+    b"T1,S001,2024-10-16 10:00:00,ITEM1,Toys,2,10.00,20.00,Card,c1\n"
+)
+REJECT_CSV = b"foo,bar\n1,2\n"
+
+
+class StubAWS(BaseHTTPRequestHandler):
+    """Just enough of S3 (path-style), Glue (JSON) and SNS (query) for the validator."""
+
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    objects = {}
+    calls = []
+
+    def log_message(self, *args):
+        pass
+
+    def _send(self, status, body=b"", headers=None):
+        self.send_response(status)
+        for k, v in (headers or {}).items():
+            self.send_header(k, v)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _s3_key(self):
+        path = unquote(urlparse(self.path).path).lstrip("/")
+        bucket, _, key = path.partition("/")
+        return bucket, key
+
+    def do_HEAD(self):
+        _, key = self._s3_key()
+        self.calls.append(("s3", "HeadObject"))
+        if key not in self.objects:
+            return self._send(404)
+        self._send(200, self.objects[key], {"ETag": '"stub"'})
+
+    def do_GET(self):
+        _, key = self._s3_key()
+        self.calls.append(("s3", "GetObject"))
+        if key not in self.objects:
+            return self._send(404, b"<Error><Code>NoSuchKey</Code></Error>")
+        data = self.objects[key]
+        rng = self.headers.get("Range")
+        if rng:
+            start, _, end = rng.replace("bytes=", "").partition("-")
+            data = data[int(start):int(end) + 1]
+            return self._send(206, data, {"ETag": '"stub"'})
+        self._send(200, data, {"ETag": '"stub"'})
+
+    def do_PUT(self):
+        _, key = self._s3_key()
+        body = self._body()
+        src = self.headers.get("x-amz-copy-source")
+        if src:
+            self.calls.append(("s3", "CopyObject"))
+            src_key = unquote(src).lstrip("/").partition("/")[2]
+            self.objects[key] = self.objects[src_key]
+            return self._send(200, b"<CopyObjectResult><ETag>\"stub\"</ETag></CopyObjectResult>")
+        self.calls.append(("s3", "PutObject"))
+        self.objects[key] = body
+        self._send(200, b"", {"ETag": '"stub"'})
+
+    def do_DELETE(self):
+        _, key = self._s3_key()
+        self.calls.append(("s3", "DeleteObject"))
+        self.objects.pop(key, None)
+        self._send(204)
+
+    def do_POST(self):
+        body = self._body()
+        target = self.headers.get("X-Amz-Target", "")
+        if target.startswith("AWSGlue."):
+            self.calls.append(("glue", target.split(".")[-1]))
+            return self._send(200, json.dumps({"JobRunId": "jr_stub"}).encode(),
+                              {"Content-Type": "application/x-amz-json-1.1"})
+        action = parse_qs(body.decode()).get("Action", [""])[0]
+        self.calls.append(("sns", action))
+        self._send(200, (
+            "<PublishResponse><PublishResult><MessageId>stub</MessageId></PublishResult>"
+            "<ResponseMetadata><RequestId>stub</RequestId></ResponseMetadata></PublishResponse>"
+        ).encode(), {"Content-Type": "text/xml"})
+
+
+CHILD = r"""
+import json, sys, time
+t0 = time.perf_counter()
+sys.path.insert(0, sys.argv[1])
+import lambda_validator as lv
+t1 = time.perf_counter()
+key = sys.argv[2]
+def event(k):
+    return {"Records": [{"s3": {"bucket": {"name": sys.argv[3]}, "object": {"key": k, "eTag": "e", "sequencer": k}}}]}
+lv.lambda_handler(event(key), None)
+t2 = time.perf_counter()
+lv.lambda_handler(event(key + ".warm"), None)
+t3 = time.perf_counter()
+print(json.dumps({"import_ms": (t1 - t0) * 1e3, "first_invoke_ms": (t2 - t1) * 1e3,
+                  "cold_total_ms": (t2 - t0) * 1e3, "warm_invoke_ms": (t3 - t2) * 1e3}))
+"""
+
+
+def run_once(port, cfg_path, scenario, i):
+    body = VALID_CSV if scenario == "valid" else REJECT_CSV
+    key = f"raw/bench_{scenario}_{i}.csv"
+    StubAWS.objects[key] = body
+    StubAWS.objects[key + ".warm"] = body
+
+    env = dict(os.environ)
+    env.update({
+        "AWS_ENDPOINT_URL": f"http://127.0.0.1:{port}",
+        "AWS_ACCESS_KEY_ID": "bench",
+        "AWS_SECRET_ACCESS_KEY": "bench",
+        "AWS_DEFAULT_REGION": "us-east-1",
+        "AWS_CONFIG_FILE": cfg_path,
+        "AWS_REQUEST_CHECKSUM_CALCULATION": "when_required",
+        "AWS_RESPONSE_CHECKSUM_VALIDATION": "when_required",
+        "BUCKET": BUCKET,
+        "GLUE_JOB_NAME": "bench-job",
+        "SNS_TOPIC_ARN": "arn:aws:sns:us-east-1:000000000000:bench",
+        "IDEMPOTENCY_STORE": "memory",
+    })
+    out = subprocess.run([sys.executable, "-c", CHILD, SCRIPTS_DIR, key, BUCKET],
+                         env=env, capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+
+def summarize(scenario, samples):
+    print(f"\n[{scenario}] runs={len(samples)}")
+    for metric in ("import_ms", "first_invoke_ms", "cold_total_ms", "warm_invoke_ms"):
+        vals = sorted(s[metric] for s in samples)
+        p90 = vals[min(len(vals) - 1, int(0.9 * len(vals)))]
+        print(f"  {metric:<16} median={statistics.median(vals):8.1f}  p90={p90:8.1f}  min={vals[0]:8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--scenario", default="all", choices=["valid", "structural_reject", "all"])
+    opts = parser.parse_args()
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StubAWS)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    port = server.server_address[1]
+
+    with tempfile.NamedTemporaryFile("w", suffix=".cfg", delete=False) as cfg:
+        cfg.write("[default]\ns3 =\n    addressing_style = path\n")
+
+    scenarios = ["valid", "structural_reject"] if opts.scenario == "all" else [opts.scenario]
+    try:
+        for scenario in scenarios:
+            StubAWS.calls.clear()
+            samples = [run_once(port, cfg.name, scenario, i) for i in range(opts.runs)]
+            summarize(scenario, samples)
+            services = sorted({svc for svc, _ in StubAWS.calls})
+            print(f"  services called: {services}")
+    finally:
+        server.shutdown()
+        os.unlink(cfg.name)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,556 @@
+# backfill_replay.py
+# Replay archived / rejected source files through the raw -> processed ETL job in
+# large parallel batches, replace the processed data of their previous runs, and
+# recompact only the touched gold dates.
+# Usage (Glue Python shell job args):
+#   --JOB_NAME             <Glue job name>
+#   --bucket               <data lake bucket>
+#   --etl_job_name         Glue job running glue_job_raw_to_processed.py
+#   --compaction_job_name  optional Glue job running incremental_auto_compaction.py (skipped if absent)
+#   --sources              optional comma list of archive,system,structural (default archive)
+#   --from_date            optional YYYY-MM-DD, select files archived/rejected on or after this day
+#   --to_date              optional YYYY-MM-DD, select files archived/rejected on or before this day
+#   --source_pattern       optional glob on the logical source file name (e.g. "sales_2024-1*")
+#   --reject_reason        optional regex matched against the <file>_reason.json of rejected files
+#   --batch_max_files      optional int, max files per ETL run (default 200)
+#   --batch_max_mb         optional int, max input MB per ETL run (default 5120)
+#   --max_concurrent_runs  optional int, ETL runs in flight at once (default 4)
+#   --sns_topic_arn        optional, passed through to the ETL job
+#   --alert_mode           optional, passed through to the ETL job (immediate | digest)
+#   --dry_run              optional "true" to only print and record the plan
+#
+# Behavior:
+#  - Lists candidate files (split files archived as prefixes count as one logical file)
+#  - Reads each file's header in parallel and groups files with an identical header line,
+#    so one ETL run can parse a whole batch with one delimiter / column mapping
+#  - Copies every batch to validated/backfill/<backfill_id>/<batch>/ and starts one ETL run
+#    per batch with --source_file_from_path=true (per-row lineage) and --archive_input=false
+#  - Records which files every backfill run holds (audit/backfill/lineage/), so a file's previous
+#    run is its last backfill run, or its original ingest run if it was never replayed
+#  - A previous backfill run also holds the other files of its batch: those are added to the
+#    replay, and the run is replaced once all of its files are committed again
+#  - Replacing a run deletes the files listed in its processed/_manifests/ entry
+#    (processed parquet + DQ rejects) so replayed data replaces instead of duplicates
+#  - Starts compaction with --force_dates for every date touched by old or new data
+#  - Logs progress/throughput and writes audit/backfill/<backfill_id>/report.json
+#  - Originals in archive/ and rejected/ are never modified
+
+import sys
+import re
+import json
+import time
+import uuid
+import zlib
+import fnmatch
+import threading
+import boto3
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from awsglue.utils import getResolvedOptions
+
+
+# Args
+
+args = getResolvedOptions(sys.argv, ["JOB_NAME", "bucket", "etl_job_name"])
+
+JOB_NAME = args["JOB_NAME"]
+bucket = args["bucket"]
+etl_job_name = args["etl_job_name"]
+
+
+# optional args via getResolvedOptions would raise if listed; so parse from sys.argv manual fallback
+def get_optional(arg_name, default=None):
+    prefix = f"--{arg_name}="
+    for i, a in enumerate(sys.argv):
+        if a.startswith(prefix):
+            return a.split("=", 1)[1]
+        # Glue passes job arguments as separate "--name value" tokens
+        if a == f"--{arg_name}" and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
+
+compaction_job_name = get_optional("compaction_job_name")
+sources = [s.strip() for s in get_optional("sources", "archive").split(",") if s.strip()]
+from_date = get_optional("from_date")
+to_date = get_optional("to_date")
+source_pattern = get_optional("source_pattern")
+reject_reason_re = re.compile(get_optional("reject_reason")) if get_optional("reject_reason") else None
+batch_max_files = int(get_optional("batch_max_files", "200"))
+batch_max_bytes = int(get_optional("batch_max_mb", "5120")) * 1024 * 1024
+max_concurrent_runs = int(get_optional("max_concurrent_runs", "4"))
+sns_topic_arn = get_optional("sns_topic_arn", "")
+alert_mode = get_optional("alert_mode", "immediate")
+dry_run = get_optional("dry_run", "false").lower() == "true"
+
+SOURCE_PREFIXES = {
+    "archive": "archive/validated/",
+    "system": "rejected/system/",
+    "structural": "rejected/structural/",
+}
+BACKFILL_PREFIX = "validated/backfill/"
+PROCESSED_PREFIX = "processed/"
+MANIFEST_PREFIX = f"{PROCESSED_PREFIX}_manifests/"
+AUDIT_PREFIX = "audit/backfill/"
+LINEAGE_PREFIX = f"{AUDIT_PREFIX}lineage/"
+HEAD_BYTES = 64 * 1024
+
+# archive/validated/<source_file>_<YYYYMMDDTHHMMSS>_<ingest_run_id>
+ARCHIVE_NAME_RE = re.compile(r"^(?P<source>.+)_(?P<ts>\d{8}T\d{6})_(?P<run_id>[0-9A-Za-z]+)$")
+
+backfill_id = datetime.utcnow().strftime("%Y%m%dT%H%M%S") + "_" + uuid.uuid4().hex[:6]
+
+s3 = boto3.client("s3")
+glue = boto3.client("glue")
+
+print(f"[INFO] Starting backfill {backfill_id}: sources={sources} from={from_date} to={to_date} "
+      f"pattern={source_pattern} reject_reason={get_optional('reject_reason')} dry_run={dry_run}")
+
+
+# Helpers: selection
+
+def list_objects(prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=prefix):
+        for obj in page.get("Contents", []):
+            yield obj
+
+
+def in_date_range(last_modified):
+    day = last_modified.strftime("%Y-%m-%d")
+    if from_date and day < from_date:
+        return False
+    if to_date and day > to_date:
+        return False
+    return True
+
+
+def list_units(source):
+    """
+    Return logical files under a source prefix. A split file (prefix of part-NNNNN.csv
+    chunks) is one unit; _reason.json / _manifest.json sidecars are not units.
+    """
+    prefix = SOURCE_PREFIXES[source]
+    units = {}
+    for obj in list_objects(prefix):
+        rel = obj["Key"][len(prefix):]
+        name = rel.split("/")[0]
+        if not name or name.endswith("_reason.json") or rel.split("/")[-1].startswith("_"):
+            continue
+        unit = units.setdefault(name, {
+            "source": source,
+            "name": name,
+            "unit_key": f"{prefix}{name}",
+            "keys": [],
+            "bytes": 0,
+            "last_modified": obj["LastModified"],
+        })
+        unit["keys"].append(obj["Key"])
+        unit["bytes"] += obj["Size"]
+
+    for unit in units.values():
+        unit["keys"].sort()
+        unit["is_prefix"] = unit["keys"][0] != unit["unit_key"]
+        m = ARCHIVE_NAME_RE.match(unit["name"]) if source == "archive" else None
+        unit["source_file"] = m.group("source") if m else unit["name"]
+        unit["previous_run_id"] = m.group("run_id") if m else None
+    return list(units.values())
+
+
+def reason_matches(unit):
+    try:
+        body = s3.get_object(Bucket=bucket, Key=f"{unit['unit_key']}_reason.json")["Body"].read()
+    except s3.exceptions.NoSuchKey:
+        return False
+    return bool(reject_reason_re.search(body.decode("utf-8", errors="replace")))
+
+
+_all_units = {}
+
+
+def all_units():
+    """Every unit under all source prefixes by unit_key (listed once, for run mates)."""
+    if not _all_units:
+        for source in SOURCE_PREFIXES:
+            _all_units.update((u["unit_key"], u) for u in list_units(source))
+    return _all_units
+
+
+def select_units():
+    selected = []
+    for source in sources:
+        for unit in list_units(source):
+            if not in_date_range(unit["last_modified"]):
+                continue
+            if source_pattern and not fnmatch.fnmatch(unit["source_file"], source_pattern):
+                continue
+            if reject_reason_re and (source == "archive" or not reason_matches(unit)):
+                continue
+            selected.append(unit)
+    return selected
+
+
+# Helpers: batching by header
+
+def read_header(unit):
+    key = unit["keys"][0]
+    data = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{HEAD_BYTES - 1}")["Body"].read()
+    if key.lower().endswith(".gz") or data[:2] == b"\x1f\x8b":
+        try:
+            data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, HEAD_BYTES)
+        except zlib.error:
+            data = b""
+    text = data.decode("utf-8", errors="replace")
+    for line in text.splitlines():
+        line = re.sub("[\ufeff\u200b\u00a0]", "", line)
+        if line.strip():
+            return line
+    return ""
+
+
+def build_batches(units):
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        headers = list(pool.map(read_header, units))
+
+    groups = {}
+    for unit, header in zip(units, headers):
+        if not header:
+            print(f"[WARN] No header found in {unit['unit_key']}, skipping")
+            continue
+        groups.setdefault(header, []).append(unit)
+
+    batches = []
+    for header, group in groups.items():
+        current, current_bytes = [], 0
+        for unit in sorted(group, key=lambda u: u["unit_key"]):
+            if current and (len(current) >= batch_max_files or current_bytes + unit["bytes"] > batch_max_bytes):
+                batches.append(current)
+                current, current_bytes = [], 0
+            current.append(unit)
+            current_bytes += unit["bytes"]
+        if current:
+            batches.append(current)
+    return batches
+
+
+# Helpers: manifests & replacement
+
+def load_json(key):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+
+
+def put_json(key, payload):
+    s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(payload, default=str).encode("utf-8"))
+
+
+def load_manifest(run_id):
+    return load_json(f"{MANIFEST_PREFIX}{run_id}.json")
+
+
+# Lineage: runs/<run_id>.json lists the units a backfill run holds;
+# units/<unit_key>.json lists the runs that still hold rows of a unit.
+
+def unit_lineage_key(unit_key):
+    return f"{LINEAGE_PREFIX}units/{unit_key}.json"
+
+
+def run_lineage_key(run_id):
+    return f"{LINEAGE_PREFIX}runs/{run_id}.json"
+
+
+def previous_runs(unit):
+    """Runs holding the unit's rows: its last backfill run(s), else its original ingest run."""
+    lineage = load_json(unit_lineage_key(unit["unit_key"]))
+    if lineage is not None:
+        return lineage["runs"]
+    return [unit["previous_run_id"]] if unit["previous_run_id"] else []
+
+
+def add_run_mates(selected):
+    """
+    Resolve previous runs and add the other units held by the same runs.
+    A backfill run holds a whole batch, so it can only be replaced once every
+    unit in it is committed again. Returns (units, {run_id: [unit_key]}).
+    """
+    with ThreadPoolExecutor(max_workers=32) as pool:
+        for unit, runs in zip(selected, pool.map(previous_runs, selected)):
+            unit["previous_runs"] = runs
+
+    by_key = {u["unit_key"]: u for u in selected}
+    pending, run_units = list(selected), {}
+    while pending:
+        unit = pending.pop()
+        if "previous_runs" not in unit:
+            unit["previous_runs"] = previous_runs(unit)
+        for run_id in unit["previous_runs"]:
+            if run_id in run_units:
+                continue
+            lineage = load_json(run_lineage_key(run_id))
+            # An original ingest run holds exactly one file
+            run_units[run_id] = lineage["units"] if lineage else [unit["unit_key"]]
+            for key in run_units[run_id]:
+                if key in by_key:
+                    continue
+                mate = all_units().get(key)
+                if mate is None:
+                    print(f"[WARN] {key} (in run {run_id}) no longer exists; run {run_id} will not be replaced")
+                    continue
+                print(f"[INFO] Adding {key}: shares previous run {run_id} with {unit['unit_key']}")
+                by_key[key] = mate
+                pending.append(mate)
+    return list(by_key.values()), run_units
+
+
+def dates_in(keys):
+    return {m.group(1) for m in (re.search(r"date=(\d{4}-\d{2}-\d{2})/", k) for k in keys) if m}
+
+
+def delete_keys(keys):
+    keys = list(keys)
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket,
+            Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+
+
+replace_lock = threading.Lock()
+committed_units = {}   # unit_key -> backfill run id
+replaced_runs = set()
+
+
+def live_runs(unit):
+    """Runs holding the unit's rows after this backfill."""
+    kept = [r for r in unit["previous_runs"] if r not in replaced_runs]
+    new_run = committed_units.get(unit["unit_key"])
+    return ([new_run] if new_run else []) + kept
+
+
+def write_unit_lineage(unit):
+    put_json(unit_lineage_key(unit["unit_key"]), {"runs": live_runs(unit), "backfill_id": backfill_id})
+
+
+def replace_previous_runs(batch, run_id):
+    """
+    Mark the batch committed, then delete processed/reject files of every previous run
+    whose units are now all committed again, and update the units' lineage.
+    """
+    with replace_lock:
+        committed_units.update((u["unit_key"], run_id) for u in batch)
+        candidates = {r for u in batch for r in u["previous_runs"]}
+        ready = sorted(r for r in candidates if r not in replaced_runs
+                       and all(k in committed_units for k in run_units[r]))
+        replaced_runs.update(ready)
+
+    touched, deleted, missing = set(), 0, []
+    for run_id in ready:
+        manifest = load_manifest(run_id)
+        if manifest is None:
+            # Pre-manifest runs: old rows stay in processed/, gold dedup keeps the newest ingest_ts
+            missing.append(run_id)
+            continue
+        touched |= dates_in(manifest["files"])
+        delete_keys(manifest["files"] + [f"{MANIFEST_PREFIX}{run_id}.json"])
+        deleted += len(manifest["files"])
+
+    for unit in batch:
+        write_unit_lineage(unit)
+    return touched, deleted, missing
+
+
+# Helpers: ETL runs
+
+def stage_batch(batch, batch_prefix):
+    """Copy a batch's files under one prefix, flattening split files to <name>__part-NNNNN.csv."""
+    copies = []
+    for unit in batch:
+        if unit["is_prefix"]:
+            for key in unit["keys"]:
+                copies.append((key, f"{batch_prefix}{unit['source_file']}__{key.split('/')[-1]}"))
+        else:
+            copies.append((unit["keys"][0], f"{batch_prefix}{unit['source_file']}"))
+
+    def copy(item):
+        src, dst = item
+        s3.copy_object(Bucket=bucket, CopySource={"Bucket": bucket, "Key": src}, Key=dst)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(copy, copies))
+
+
+def start_etl(batch_prefix, run_id, batch_name):
+    glue_args = {
+        "--s3_input_path": f"s3://{bucket}/{batch_prefix}",
+        "--s3_output_path": f"s3://{bucket}/{PROCESSED_PREFIX}",
+        "--ingest_run_id": run_id,
+        "--source_file": batch_name,
+        "--original_key": batch_prefix,
+        "--sns_topic_arn": sns_topic_arn,
+        "--source_file_from_path": "true",
+        "--archive_input": "false",
+        "--alert_mode": alert_mode,
+    }
+    while True:
+        try:
+            return glue.start_job_run(JobName=etl_job_name, Arguments=glue_args)["JobRunId"]
+        except glue.exceptions.ConcurrentRunsExceededException:
+            time.sleep(30)
+
+
+def wait_for_run(job_name, job_run_id):
+    while True:
+        run = glue.get_job_run(JobName=job_name, RunId=job_run_id)["JobRun"]
+        state = run["JobRunState"]
+        if state in ("SUCCEEDED", "FAILED", "STOPPED", "TIMEOUT", "ERROR"):
+            return state, run.get("ErrorMessage")
+        time.sleep(20)
+
+
+progress_lock = threading.Lock()
+progress = {"batches_done": 0, "files_done": 0, "bytes_done": 0, "rows_good": 0, "rows_rejected": 0,
+            "batches_failed": 0}
+
+
+def report_progress(total_batches, total_files, total_bytes, started):
+    elapsed = max(time.time() - started, 1e-6)
+    print(
+        f"[PROGRESS] batches {progress['batches_done']}/{total_batches} "
+        f"(failed {progress['batches_failed']}) | files {progress['files_done']}/{total_files} | "
+        f"{progress['bytes_done'] / 1024 / 1024:.1f}/{total_bytes / 1024 / 1024:.1f} MB | "
+        f"rows good={progress['rows_good']} rejected={progress['rows_rejected']} | "
+        f"{elapsed:.0f}s, {progress['files_done'] / elapsed:.2f} files/s, "
+        f"{progress['bytes_done'] / 1024 / 1024 / elapsed:.2f} MB/s"
+    )
+
+
+def process_batch(index, batch, total_batches, total_files, total_bytes, started):
+    batch_name = f"backfill_{backfill_id}_b{index:04d}"
+    batch_prefix = f"{BACKFILL_PREFIX}{backfill_id}/b{index:04d}/"
+    run_id = f"bf{uuid.uuid4().hex[:8]}"
+    result = {
+        "batch": index,
+        "ingest_run_id": run_id,
+        "files": [u["unit_key"] for u in batch],
+        "bytes": sum(u["bytes"] for u in batch),
+    }
+
+    # Recorded before the run starts, so committed rows are never untracked
+    put_json(run_lineage_key(run_id), {"units": result["files"], "backfill_id": backfill_id})
+    stage_batch(batch, batch_prefix)
+    job_run_id = start_etl(batch_prefix, run_id, batch_name)
+    state, error = wait_for_run(etl_job_name, job_run_id)
+    result.update({"job_run_id": job_run_id, "state": state, "error": error})
+
+    touched = set()
+    if state == "SUCCEEDED":
+        manifest = load_manifest(run_id) or {"files": [], "counts": {}}
+        touched |= dates_in(manifest["files"])
+        old_dates, deleted, missing = replace_previous_runs(batch, run_id)
+        touched |= old_dates
+        counts = manifest.get("counts", {})
+        result.update({"counts": counts, "replaced_files": deleted, "missing_previous_manifests": missing})
+    else:
+        counts = {}
+        print(f"[ERROR] Batch {index} run {job_run_id} ended {state}: {error}")
+    result["dates"] = sorted(touched)
+
+    with progress_lock:
+        progress["batches_done"] += 1
+        progress["files_done"] += len(batch)
+        progress["bytes_done"] += result["bytes"]
+        progress["batches_failed"] += 0 if state == "SUCCEEDED" else 1
+        progress["rows_good"] += counts.get("good", 0)
+        progress["rows_rejected"] += sum(v for k, v in counts.items() if k != "good")
+        report_progress(total_batches, total_files, total_bytes, started)
+    return result
+
+
+# Plan
+
+units = select_units()
+print(f"[INFO] Selected {len(units)} files ({sum(u['bytes'] for u in units) / 1024 / 1024:.1f} MB)")
+selected_keys = {u["unit_key"] for u in units}
+units, run_units = add_run_mates(units)
+added_units = sorted(u["unit_key"] for u in units if u["unit_key"] not in selected_keys)
+
+batches = build_batches(units) if units else []
+total_files = sum(len(b) for b in batches)
+total_bytes = sum(u["bytes"] for b in batches for u in b)
+print(f"[INFO] Planned {len(batches)} batches, max_concurrent_runs={max_concurrent_runs}")
+
+report = {
+    "backfill_id": backfill_id,
+    "job_name": JOB_NAME,
+    "started_at_utc": datetime.utcnow().isoformat(),
+    "filters": {"sources": sources, "from_date": from_date, "to_date": to_date,
+                "source_pattern": source_pattern, "reject_reason": get_optional("reject_reason")},
+    "dry_run": dry_run,
+    "added_run_mates": added_units,
+    "previous_runs": run_units,
+    "planned_batches": [[u["unit_key"] for u in b] for b in batches],
+    "results": [],
+}
+
+
+# Execute
+
+started = time.time()
+if batches and not dry_run:
+    with ThreadPoolExecutor(max_workers=max_concurrent_runs) as pool:
+        futures = [pool.submit(process_batch, i, b, len(batches), total_files, total_bytes, started)
+                   for i, b in enumerate(batches)]
+        for f in as_completed(futures):
+            try:
+                report["results"].append(f.result())
+            except Exception as e:
+                print(f"[ERROR] Batch failed before completion: {e}")
+                report["results"].append({"state": "ERROR", "error": str(e)})
+
+# Runs replaced by a later batch may still be listed in an earlier batch's unit lineage
+if committed_units:
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(write_unit_lineage, [u for u in units if u["unit_key"] in committed_units]))
+
+touched_dates = sorted({d for r in report["results"] for d in r.get("dates", [])})
+report["touched_dates"] = touched_dates
+# Runs still waiting for a failed batch mate keep the old rows; the lineage keeps pointing at them
+report["unreplaced_runs"] = sorted(set(run_units) - replaced_runs) if not dry_run else []
+
+
+# Recompact only the touched gold dates
+
+if touched_dates and compaction_job_name and not dry_run:
+    try:
+        run = glue.start_job_run(JobName=compaction_job_name, Arguments={
+            "--force_dates": ",".join(touched_dates),
+            "--max_partitions": str(len(touched_dates)),
+        })
+        report["compaction_job_run_id"] = run["JobRunId"]
+        print(f"[INFO] Started compaction {run['JobRunId']} for {len(touched_dates)} dates")
+    except Exception as e:
+        report["compaction_error"] = str(e)
+        print(f"[ERROR] Failed to start compaction: {e}")
+
+
+# Report
+
+elapsed = time.time() - started
+report.update({
+    "finished_at_utc": datetime.utcnow().isoformat(),
+    "elapsed_seconds": round(elapsed, 1),
+    "files": total_files,
+    "bytes": total_bytes,
+    "progress": progress,
+    "files_per_second": round(progress["files_done"] / elapsed, 3) if elapsed > 0 else None,
+    "mb_per_second": round(progress["bytes_done"] / 1024 / 1024 / elapsed, 3) if elapsed > 0 else None,
+})
+report_key = f"{AUDIT_PREFIX}{backfill_id}/report.json"
+s3.put_object(Bucket=bucket, Key=report_key, Body=json.dumps(report, default=str).encode("utf-8"))
+print(f"[INFO] Wrote backfill report to s3://{bucket}/{report_key}")
+
+if progress["batches_failed"]:
+    raise RuntimeError(f"{progress['batches_failed']} backfill batches failed; see {report_key}")
+
+print("[INFO] Backfill finished.")
@@ -1,9 +1,13 @@
 
 import sys
+import builtins
 import boto3
 import csv
+import re
+import json
 from io import StringIO
 import datetime
+from concurrent.futures import ThreadPoolExecutor
 
 from awsglue.context import GlueContext
 from awsglue.utils import getResolvedOptions
@@ -42,6 +46,60 @@ validated_key = "/".join(input_path.split("/")[3:])
 dq_json_path = output_path.replace("processed", "rejected/data_quality/json")
 dq_csv_path  = output_path.replace("processed", "rejected/data_quality/csv")
 
+
+# optional args via getResolvedOptions would raise if listed; so parse from sys.argv manual fallback
+def get_optional(arg_name, default=None):
+    prefix = f"--{arg_name}="
+    for i, a in enumerate(sys.argv):
+        if a.startswith(prefix):
+            return a.split("=", 1)[1]
+        # Glue passes job arguments as separate "--name value" tokens
+        if a == f"--{arg_name}" and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
+    return default
+
+max_attempts = int(get_optional("max_attempts", "1"))
+staging_root = get_optional("staging_prefix", "staging/").rstrip("/") + "/"
+
+# Backfill batches: one input prefix holds many logical files, so source_file is
+# taken per row from the object name, and the inputs (copies of already archived
+# files) are deleted instead of archived again.
+source_file_from_path = get_optional("source_file_from_path", "false").lower() == "true"
+archive_input         = get_optional("archive_input", "true").lower() == "true"
+
+# Alert digests: with --alert_mode digest the DQ report is buffered for the
+# validator's scheduled digest flush instead of being published per file.
+alert_mode   = get_optional("alert_mode", "immediate").lower()
+alert_prefix = get_optional("alert_prefix", "alerts/")
+
+# Column profiles: computed in the counting pass, stored under the audit prefix
+# and compared against a rolling baseline to flag upstream drift.
+profile_enabled       = get_optional("profile", "true").lower() == "true"
+profile_prefix        = get_optional("profile_prefix", "audit/ingest_profiles/").rstrip("/") + "/"
+profile_top_k         = int(get_optional("profile_top_k", "10"))
+drift_baseline_runs   = int(get_optional("drift_baseline_runs", "20"))
+
+# Spark settings sized from the input (see plan_spark_settings)
+auto_tune           = get_optional("auto_tune", "true").lower() == "true"
+target_partition_mb = int(get_optional("target_partition_mb", "128"))
+
+
+def key_prefix(s3_path):
+    return "/".join(s3_path.split("/")[3:]).rstrip("/") + "/"
+
+# Run-scoped staging area: every output is written here first and only copied
+# to its final location once all stages have succeeded.
+staging_key    = f"{staging_root}{ingest_run_id}/"
+staging_path   = f"s3://{bucket_name}/{staging_key}"
+checkpoint_key = f"{staging_key}_checkpoint.json"
+manifest_key   = f"{key_prefix(output_path)}_manifests/{ingest_run_id}.json"
+
+staged_targets = {
+    "processed/":    key_prefix(output_path),
+    "rejects_json/": key_prefix(dq_json_path),
+    "rejects_csv/":  key_prefix(dq_csv_path),
+}
+
 sns_client = boto3.client("sns")
 s3 = boto3.client("s3")
 
@@ -59,6 +117,32 @@ job.init(args["JOB_NAME"], args)
 
 
 
+# UTILITY: Input may be a single validated file or a prefix of split chunks
+# (validated/<name>/part-NNNNN.csv + _manifest.json) written by the Lambda.
+
+def list_input_keys():
+    if not validated_key.endswith("/"):
+        return [validated_key]
+    keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=validated_key):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def move_input(target_key):
+    """Move the validated input to target_key, keeping chunk names under it for split files."""
+    for key in list_input_keys():
+        dst = target_key if key == validated_key else f"{target_key}/{key[len(validated_key):]}"
+        s3.copy_object(
+            Bucket=bucket_name,
+            CopySource={"Bucket": bucket_name, "Key": key},
+            Key=dst)
+        s3.delete_object(Bucket=bucket_name, Key=key)
+
+
+
+
 # UTILITY: Move file safely to rejected/system
 
 def move_to_system_reject(reason_text):
@@ -66,11 +150,7 @@ def move_to_system_reject(reason_text):
     reason_key = f"{reject_key}_reason.json"
 
     try:
-        s3.copy_object(
-            Bucket=bucket_name,
-            CopySource={"Bucket": bucket_name, "Key": validated_key},
-            Key=reject_key)
-        s3.delete_object(Bucket=bucket_name, Key=validated_key)
+        move_input(reject_key)
     except:
         pass
 
@@ -80,336 +160,842 @@ def move_to_system_reject(reason_text):
         Body=str(reason_text)
     )
 
-    if sns_topic:
-        sns_client.publish(
-            TopicArn=sns_topic,
-            Subject="GLUE SYSTEM FAILURE",
-            Message=str(reason_text)
-        )
+    publish_alert("GLUE SYSTEM FAILURE", str(reason_text), critical=True)
+
+
+
+
+# UTILITY: Publish an SNS alert, or buffer it for the next digest
+
+def publish_alert(subject, message, metrics=None, critical=False):
+    if not sns_topic:
+        return
+    if alert_mode == "digest" and not critical:
+        category = subject.replace(" ", "_")
+        created = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%SZ")
+        alert = {
+            "subject": subject,
+            "message": message,
+            "ref": source_file,
+            "origin": f"glue:{args['JOB_NAME']}:{ingest_run_id}",
+            "created_at": created,
+            "metrics": metrics or {},
+        }
+        # Keyed on the run id only, so a retried run overwrites instead of duplicating
+        s3.put_object(
+            Bucket=bucket_name,
+            Key=f"{alert_prefix}pending/{category}/{ingest_run_id}.json",
+            Body=json.dumps(alert).encode("utf-8"))
+        return
+    sns_client.publish(TopicArn=sns_topic, Subject=subject, Message=message)
+
+
+
+
+# UTILITY: Checkpoints, staged commit and staging GC
+
+def load_checkpoint():
+    try:
+        body = s3.get_object(Bucket=bucket_name, Key=checkpoint_key)["Body"].read()
+        return json.loads(body)
+    except s3.exceptions.NoSuchKey:
+        return {"ingest_run_id": ingest_run_id, "source_file": source_file, "attempts": 0, "stages": {}}
+
+
+def save_checkpoint():
+    s3.put_object(Bucket=bucket_name, Key=checkpoint_key, Body=json.dumps(checkpoint).encode("utf-8"))
+
+
+def stage_done(name):
+    return name in checkpoint["stages"]
+
+
+def mark_stage(name, **info):
+    info["completed_at"] = datetime.datetime.utcnow().isoformat()
+    checkpoint["stages"][name] = info
+    save_checkpoint()
+    print(f"Checkpoint: stage '{name}' complete")
+
+
+def list_keys(prefix):
+    keys = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=prefix):
+        keys.extend(obj["Key"] for obj in page.get("Contents", []))
+    return keys
+
+
+def delete_keys(keys):
+    for i in range(0, len(keys), 1000):
+        s3.delete_objects(
+            Bucket=bucket_name,
+            Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+
+
+def staged_commit_plan():
+    """Map every staged data file to its final key (Spark markers like _SUCCESS are skipped).
+
+    Final file names are prefixed with "<ingest_run_id>__", so readers can tell which
+    run a file belongs to and ignore files of runs without a manifest.
+    """
+    plan = []
+    for sub, target in staged_targets.items():
+        src_prefix = f"{staging_key}{sub}"
+        for key in list_keys(src_prefix):
+            rel = key[len(src_prefix):]
+            folder, _, name = rel.rpartition("/")
+            if name.startswith(("_", ".")):
+                continue
+            plan.append((key, f"{target}{folder + '/' if folder else ''}{ingest_run_id}__{name}"))
+    return plan
+
+
+def commit_staged():
+    """Copy staged files to their final keys, then publish the run manifest.
+
+    Spark part names are unique per write, so final keys are deterministic and the
+    copy can simply be repeated on retry. The manifest is written last and marks
+    the run as committed: the gold job only reads files of runs with a manifest.
+    """
+    plan = staged_commit_plan()
+
+    def copy(item):
+        src, dst = item
+        s3.copy_object(Bucket=bucket_name, CopySource={"Bucket": bucket_name, "Key": src}, Key=dst)
+
+    with ThreadPoolExecutor(max_workers=16) as pool:
+        list(pool.map(copy, plan))
+
+    manifest = {
+        "ingest_run_id": ingest_run_id,
+        "source_file": source_file,
+        "committed_at": datetime.datetime.utcnow().isoformat(),
+        "counts": checkpoint["stages"]["staged"]["counts"],
+        "files": [dst for _, dst in plan],
+    }
+    s3.put_object(Bucket=bucket_name, Key=manifest_key, Body=json.dumps(manifest).encode("utf-8"))
+    return len(plan)
+
+
+def rollback_commit():
+    """Remove this run's manifest first (un-committing it), then its final-location files."""
+    manifest = load_json(manifest_key) or {"files": []}
+    delete_keys([manifest_key])
+    delete_keys(sorted(set(manifest["files"]) | {dst for _, dst in staged_commit_plan()}))
+
+
+
+
+# UTILITY: Input-size-aware Spark settings
+#
+# Glue starts every run with the same defaults (200 shuffle partitions, 10 MB
+# broadcast threshold) whether the input is a 100 KB file or a 20 GB backfill
+# batch. The input size is known from the S3 listing before any plan is built,
+# so the session-level SQL settings are sized from it. Executor count and memory
+# are fixed when the Glue job starts and are not touched here.
+
+GZIP_EXPANSION       = 6.0    # rough uncompressed bytes per gzip byte
+CSV_TO_PARQUET_RATIO = 0.25   # rough Parquet output bytes per CSV byte
+
+
+def input_size_bytes():
+    """Uncompressed-equivalent size of the input file / chunk prefix."""
+    total = 0.0
+    if validated_key.endswith("/"):
+        objects = []
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=bucket_name, Prefix=validated_key):
+            objects.extend((o["Key"], o["Size"]) for o in page.get("Contents", []))
+    else:
+        objects = [(validated_key, s3.head_object(Bucket=bucket_name, Key=validated_key)["ContentLength"])]
+    for key, size in objects:
+        total += size * (GZIP_EXPANSION if key.lower().endswith(".gz") else 1.0)
+    return int(total)
+
+
+def ceil_div(a, b):
+    return int(-(-a // b))
+
+
+def plan_spark_settings(input_bytes):
+    target = target_partition_mb * 1024 * 1024
+    cores = sc.defaultParallelism
+    splits = ceil_div(input_bytes, target) if input_bytes else 1
+    # Small inputs get one shuffle partition per target-sized split; anything
+    # larger than one split uses at least every core. AQE coalesces further.
+    shuffle_partitions = splits if splits <= 1 else builtins.max(splits, cores)
+    # A side up to 1% of the input (10 MB - 128 MB) may be broadcast
+    broadcast = builtins.min(builtins.max(input_bytes // 100, 10 * 1024 * 1024), 128 * 1024 * 1024)
+    write_partitions = ceil_div(input_bytes * CSV_TO_PARQUET_RATIO, target) if input_bytes else 1
+    return {
+        "input_bytes": input_bytes,
+        "cores": cores,
+        "write_partitions": builtins.min(write_partitions, shuffle_partitions),
+        "spark.sql.shuffle.partitions": shuffle_partitions,
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": target,
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": int(broadcast),
+        "spark.sql.files.maxPartitionBytes": target,
+    }
+
+
+def apply_spark_settings(settings):
+    for name, value in settings.items():
+        if name.startswith("spark."):
+            spark.conf.set(name, str(value))
+    print(f"[INFO] Spark settings: {json.dumps(settings)}")
+
+
+
+
+# UTILITY: Column profiles and drift against a rolling baseline
+#
+# The baseline (<profile_prefix>baseline.json) is an exponentially weighted
+# average over the last ~drift_baseline_runs profiles: null rates, numeric
+# min/mean/max and the share of each categorical value / timestamp format.
+# Concurrent runs may overwrite each other's baseline update; for a smoothed
+# baseline that only drops a sample.
+
+PROFILE_CATEGORICAL = ["payment_method", "item_category"]
+PROFILE_DISTINCT    = ["transaction_id", "store_id", "item_id", "item_category",
+                       "payment_method", "customer_id"]
+PROFILE_NULLABLE    = ["transaction_id", "store_id", "timestamp_raw", "item_id", "item_category",
+                       "quantity", "unit_price", "revenue", "payment_method", "customer_id"]
+PROFILE_NUMERIC     = {"quantity": "quantity_num", "unit_price": "unit_price_num", "revenue": "revenue_num"}
+
+DRIFT_MIN_BASELINE_RUNS = 3      # no drift flags while the baseline is warming up
+DRIFT_NULL_RATE_DELTA   = 0.05   # absolute change of a column's null rate
+DRIFT_MEAN_CHANGE       = 0.5    # relative change of a numeric mean
+DRIFT_RANGE_FACTOR      = 3.0    # max above / min below baseline by this factor
+DRIFT_NEW_VALUE_SHARE   = 0.01   # unseen categorical value / timestamp format share
+DRIFT_PRUNE_SHARE       = 0.0005 # values rarer than this are dropped from the baseline
+
+
+def build_profile(rows, total_rows):
+    """Turn the (dim, val) aggregation rows into a compact profile dict."""
+    everything = [r for r in rows if r["dim"] == "_all"][0]
+    profile = {
+        "ingest_run_id": ingest_run_id,
+        "source_file": source_file,
+        "created_at": datetime.datetime.utcnow().isoformat(),
+        "rows": total_rows,
+        "columns": {},
+        "top_values": {},
+        "timestamp_formats": {},
+    }
+    for c in PROFILE_NULLABLE:
+        stats = {"null_rate": float(f"{everything[c + '__nulls'] / total_rows:.6f}") if total_rows else 0.0}
+        if c in PROFILE_DISTINCT:
+            stats["approx_distinct"] = everything[f"{c}__distinct"]
+        profile["columns"][c] = stats
+    for c in PROFILE_NUMERIC:
+        for stat in ("min", "max", "mean"):
+            profile["columns"][c][stat] = everything[f"{c}__{stat}"]
+    ts_min, ts_max = everything["timestamp__min"], everything["timestamp__max"]
+    profile["columns"]["timestamp_raw"]["min"] = ts_min.isoformat() if ts_min else None
+    profile["columns"]["timestamp_raw"]["max"] = ts_max.isoformat() if ts_max else None
+
+    for dim in PROFILE_CATEGORICAL:
+        values = sorted(((r["val"] if r["val"] is not None else "<null>", r["rows"])
+                         for r in rows if r["dim"] == dim), key=lambda kv: -kv[1])
+        profile["top_values"][dim] = [[v, n] for v, n in values[:profile_top_k]]
+        profile["columns"][dim]["other_rows"] = total_rows - builtins.sum(n for _, n in values[:profile_top_k])
+    profile["timestamp_formats"] = {r["val"]: r["rows"] for r in rows if r["dim"] == "ts_format"}
+    return profile
+
+
+def value_shares(profile):
+    total = profile["rows"] or 1
+    shares = {dim: {v: n / total for v, n in pairs} for dim, pairs in profile["top_values"].items()}
+    shares["timestamp_format"] = {f: n / total for f, n in profile["timestamp_formats"].items()}
+    return shares
+
+
+def detect_drift(profile, baseline):
+    if not baseline or baseline.get("runs", 0) < DRIFT_MIN_BASELINE_RUNS or not profile["rows"]:
+        return []
+    flags = []
+    for c, stats in profile["columns"].items():
+        base = baseline["columns"].get(c, {})
+        if "null_rate" in base and builtins.abs(stats["null_rate"] - base["null_rate"]) > DRIFT_NULL_RATE_DELTA:
+            flags.append({"check": "null_rate", "column": c,
+                          "detail": f"{stats['null_rate']:.3f} vs baseline {base['null_rate']:.3f}"})
+        if c not in PROFILE_NUMERIC or stats.get("mean") is None or base.get("mean") is None:
+            continue
+        if base["mean"] and builtins.abs(stats["mean"] - base["mean"]) / builtins.abs(base["mean"]) > DRIFT_MEAN_CHANGE:
+            flags.append({"check": "mean", "column": c,
+                          "detail": f"{stats['mean']:.4g} vs baseline {base['mean']:.4g}"})
+        if base["max"] and base["max"] > 0 and stats["max"] > base["max"] * DRIFT_RANGE_FACTOR:
+            flags.append({"check": "max", "column": c,
+                          "detail": f"{stats['max']:.4g} vs baseline {base['max']:.4g}"})
+        if stats["min"] < 0 <= base["min"] or (base["min"] < 0 and stats["min"] < base["min"] * DRIFT_RANGE_FACTOR):
+            flags.append({"check": "min", "column": c,
+                          "detail": f"{stats['min']:.4g} vs baseline {base['min']:.4g}"})
+    for dim, shares in value_shares(profile).items():
+        known = baseline["values"].get(dim, {})
+        new = sorted(v for v, share in shares.items() if share >= DRIFT_NEW_VALUE_SHARE and v not in known)
+        if new:
+            flags.append({"check": "new_values", "column": dim, "detail": ", ".join(new[:10])})
+    return flags
+
+
+def update_baseline(baseline, profile):
+    baseline = baseline or {"runs": 0, "columns": {}, "values": {}}
+    runs = baseline["runs"] + 1
+    # plain running average until the window is full, then EWMA with alpha = 1/N
+    alpha = 1.0 / runs if runs < drift_baseline_runs else 1.0 / drift_baseline_runs
+
+    def blend(old, new):
+        if new is None:
+            return old
+        return new if old is None else old + alpha * (new - old)
+
+    for c, stats in profile["columns"].items():
+        base = baseline["columns"].setdefault(c, {})
+        for stat in ("null_rate", "min", "mean", "max"):
+            if stat in stats and not isinstance(stats[stat], str):
+                base[stat] = blend(base.get(stat), stats[stat])
+    for dim, shares in value_shares(profile).items():
+        known = baseline["values"].setdefault(dim, {})
+        for v in set(known) | set(shares):
+            known[v] = blend(known.get(v, 0.0), shares.get(v, 0.0))
+        baseline["values"][dim] = {v: share for v, share in known.items() if share >= DRIFT_PRUNE_SHARE}
+
+    baseline["runs"] = runs
+    baseline["updated_at"] = datetime.datetime.utcnow().isoformat()
+    baseline["last_ingest_run_id"] = ingest_run_id
+    return baseline
+
+
+def load_json(key):
+    try:
+        return json.loads(s3.get_object(Bucket=bucket_name, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
 
 
 
 
 # MAIN PROCESSING LOGIC (Wrapped in try/except for atomicity)
 
+checkpoint = load_checkpoint()
+checkpoint["attempts"] += 1
+save_checkpoint()
+
+if checkpoint["stages"]:
+    print(f"Resuming run {ingest_run_id} (attempt {checkpoint['attempts']}), completed stages: {list(checkpoint['stages'])}")
+
 try:
     
-    # 3. Read file as raw
-    
-    raw_df = spark.read.text(input_path)
+    # 3-15. Parse, classify and stage outputs (skipped when resuming after staging)
+
+    if not stage_done("staged"):
+
+        # 3. Read file as raw (Spark settings sized from the input first)
 
-    clean_df = raw_df.withColumn(
-        "value",
-        regexp_replace("value", "[\\uFEFF\\u200B\\u00A0]", "")
-    ).filter(trim(col("value")) != "")
+        spark_settings = None
+        if auto_tune:
+            spark_settings = plan_spark_settings(input_size_bytes())
+            apply_spark_settings(spark_settings)
+
+        raw_df = spark.read.text(input_path).withColumn("input_file", input_file_name())
+
+        clean_df = raw_df.withColumn(
+            "value",
+            regexp_replace("value", "[\\uFEFF\\u200B\\u00A0]", "")
+        ).filter(trim(col("value")) != "")
 
 
     
-    # 4. Detect delimiter
+        # 4. Detect delimiter
  
-    sample_lines = [r.value for r in clean_df.limit(20).collect()]
-    sample_text = "\n".join(sample_lines)
+        sample_lines = [r.value for r in clean_df.limit(20).collect()]
+        sample_text = "\n".join(sample_lines)
 
-    detected = None
-    try:
-        dialect = csv.Sniffer().sniff(sample_text, delimiters=";,|\t")
-        detected = dialect.delimiter
-    except:
-        pass
+        detected = None
+        try:
+            dialect = csv.Sniffer().sniff(sample_text, delimiters=";,|\t")
+            detected = dialect.delimiter
+        except:
+            pass
 
-    if detected is None:
-        candidates = [",", ";", "|", "\t"]
-        counts = {c: sample_text.count(c) for c in candidates}
+        if detected is None:
+            candidates = [",", ";", "|", "\t"]
+            counts = {c: sample_text.count(c) for c in candidates}
 
-        # Safe fallback detection
-        detected = sorted(counts.items(), key=lambda x: x[1], reverse=True)[0][0]
+            # Safe fallback detection
+            detected = sorted(counts.items(), key=lambda x: x[1], reverse=True)[0][0]
 
-    if counts[detected] == 0:
-        detected = ","
+        if counts[detected] == 0:
+            detected = ","
 
-    delimiter = detected
-    print(f"Detected delimiter: {delimiter}")
+        delimiter = detected
+        print(f"Detected delimiter: {delimiter}")
 
 
    
-    # 5. Extract header row and normalize
+        # 5. Extract header row and normalize
     
-    header_line = clean_df.first()["value"]
-    header_raw_cols = header_line.split(delimiter)
+        header_line = clean_df.first()["value"]
+        header_raw_cols = header_line.split(delimiter)
 
-    def normalize_header(colname):
-        c = colname.lower()
-        c = c.replace(" ", "_").replace("-", "_")
-        c = "".join([ch for ch in c if ch.isalnum() or ch == "_"])
-        return c
+        def normalize_header(colname):
+            c = colname.lower()
+            c = c.replace(" ", "_").replace("-", "_")
+            c = "".join([ch for ch in c if ch.isalnum() or ch == "_"])
+            return c
 
-    normalized = [normalize_header(x) for x in header_raw_cols]
+        normalized = [normalize_header(x) for x in header_raw_cols]
 
-    synonyms = {
-        "transactionid": "transaction_id",
-        "transid": "transaction_id",
-        "txn_id": "transaction_id",
+        synonyms = {
+            "transactionid": "transaction_id",
+            "transid": "transaction_id",
+            "txn_id": "transaction_id",
 
-        "storeid": "store_id",
-        "shop_id": "store_id",
+            "storeid": "store_id",
+            "shop_id": "store_id",
 
-        "itemid": "item_id",
-        "product_id": "item_id",
+            "itemid": "item_id",
+            "product_id": "item_id",
 
-        "qty": "quantity",
-        "quantitysold": "quantity",
+            "qty": "quantity",
+            "quantitysold": "quantity",
 
-        "unitprice": "unit_price",
-        "price": "unit_price",
+            "unitprice": "unit_price",
+            "price": "unit_price",
 
-        "revenueamount": "revenue",
-        "amount": "revenue",
-        "revenue": "revenue",
-    }
+            "revenueamount": "revenue",
+            "amount": "revenue",
+            "revenue": "revenue",
+        }
 
-    final_headers = [synonyms.get(h, h) for h in normalized]
+        final_headers = [synonyms.get(h, h) for h in normalized]
 
 
    
-    # 6. Required columns
+        # 6. Required columns
    
-    REQUIRED = {
-        "transaction_id",
-        "store_id",
-        "timestamp",
-        "item_id",
-        "quantity",
-        "unit_price",
-        "revenue"
-    }
+        REQUIRED = {
+            "transaction_id",
+            "store_id",
+            "timestamp",
+            "item_id",
+            "quantity",
+            "unit_price",
+            "revenue"
+        }
 
-    index_map = {final_headers[i]: i for i in range(len(final_headers))}
+        index_map = {final_headers[i]: i for i in range(len(final_headers))}
 
 
    
-    # 7. Split rows (skip header)
+        # 7. Split rows (skip header)
   
-    data_df = clean_df.filter(col("value") != header_line)
-    split_df = data_df.withColumn("cols", split(col("value"), delimiter))
+        data_df = clean_df.filter(col("value") != header_line)
+        split_df = data_df.withColumn("cols", split(col("value"), delimiter))
 
 
     
-    # 8. Extract mapped columns
+        # 8. Extract mapped columns
     
-    def extr(name):
-        idx = index_map.get(name, None)
-        if idx is None:
-            return lit(None)
-        return col("cols")[idx]
-
-    df_extracted = split_df.select(
-        extr("transaction_id").alias("transaction_id"),
-        extr("store_id").alias("store_id"),
-        extr("timestamp").alias("timestamp_raw"),
-        extr("item_id").alias("item_id"),
-        extr("item_category").alias("item_category"),
-        extr("quantity").alias("quantity"),
-        extr("unit_price").alias("unit_price"),
-        extr("revenue").alias("revenue"),
-        extr("payment_method").alias("payment_method"),
-        extr("customer_id").alias("customer_id"),
-        col("value").alias("raw_row")
-    )
+        def extr(name):
+            idx = index_map.get(name, None)
+            if idx is None:
+                return lit(None)
+            return col("cols")[idx]
+
+        df_extracted = split_df.select(
+            extr("transaction_id").alias("transaction_id"),
+            extr("store_id").alias("store_id"),
+            extr("timestamp").alias("timestamp_raw"),
+            extr("item_id").alias("item_id"),
+            extr("item_category").alias("item_category"),
+            extr("quantity").alias("quantity"),
+            extr("unit_price").alias("unit_price"),
+            extr("revenue").alias("revenue"),
+            extr("payment_method").alias("payment_method"),
+            extr("customer_id").alias("customer_id"),
+            col("value").alias("raw_row"),
+            col("input_file")
+        )
 
 
     
-    # 9. Structural rejects
+        # 9. Structural rejects
     
-    missing_req_cond = (
-        col("transaction_id").isNull() |
-        col("store_id").isNull() |
-        col("timestamp_raw").isNull() |
-        col("item_id").isNull() |
-        col("quantity").isNull() |
-        col("unit_price").isNull() |
-        col("revenue").isNull()
-    )
+        missing_req_cond = (
+            col("transaction_id").isNull() |
+            col("store_id").isNull() |
+            col("timestamp_raw").isNull() |
+            col("item_id").isNull() |
+            col("quantity").isNull() |
+            col("unit_price").isNull() |
+            col("revenue").isNull()
+        )
 
-    struct_rejects = df_extracted.filter(missing_req_cond) \
-        .withColumn("reject_reason", lit("MISSING_REQUIRED_COLUMN"))
+        struct_rejects = df_extracted.filter(missing_req_cond) \
+            .withColumn("reject_reason", lit("MISSING_REQUIRED_COLUMN"))
 
-    df_struct_good = df_extracted.filter(~missing_req_cond)
+        df_struct_good = df_extracted.filter(~missing_req_cond)
 
 
     
-    # 10. Hardened Multi-format timestamp parsing
+        # 10. Hardened Multi-format timestamp parsing
     
-    timestamp_patterns = [
-        (r"^\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}:\d{2}$", "yyyy-MM-dd H:mm:ss"),
-        (r"^\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}$", "yyyy-MM-dd H:mm"),
+        timestamp_patterns = [
+            (r"^\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}:\d{2}$", "yyyy-MM-dd H:mm:ss"),
+            (r"^\d{4}-\d{2}-\d{2} \d{1,2}:\d{2}$", "yyyy-MM-dd H:mm"),
 
-        (r"^\d{4}/\d{2}/\d{2} \d{1,2}:\d{2}:\d{2}$", "yyyy/MM/dd H:mm:ss"),
-        (r"^\d{4}/\d{2}/\d{2} \d{1,2}:\d{2}$", "yyyy/MM/dd H:mm"),
+            (r"^\d{4}/\d{2}/\d{2} \d{1,2}:\d{2}:\d{2}$", "yyyy/MM/dd H:mm:ss"),
+            (r"^\d{4}/\d{2}/\d{2} \d{1,2}:\d{2}$", "yyyy/MM/dd H:mm"),
 
-        (r"^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}:\d{2}$", "MM/dd/yyyy H:mm:ss"),
-        (r"^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}$", "MM/dd/yyyy H:mm"),
+            (r"^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}:\d{2}$", "MM/dd/yyyy H:mm:ss"),
+            (r"^\d{2}/\d{2}/\d{4} \d{1,2}:\d{2}$", "MM/dd/yyyy H:mm"),
 
-        (r"^\d{2}/\d{2}/\d{4}$", "MM/dd/yyyy"),
-        (r"^\d{4}-\d{2}-\d{2}$", "yyyy-MM-dd"),
-        (r"^\d{4}/\d{2}/\d{2}$", "yyyy/MM/dd"),
+            (r"^\d{2}/\d{2}/\d{4}$", "MM/dd/yyyy"),
+            (r"^\d{4}-\d{2}-\d{2}$", "yyyy-MM-dd"),
+            (r"^\d{4}/\d{2}/\d{2}$", "yyyy/MM/dd"),
 
-        (r"^\d{8} \d{6}$", "yyyyMMdd HHmmss"),
-        (r"^\d{8}$", "yyyyMMdd"),
-    ]
+            (r"^\d{8} \d{6}$", "yyyyMMdd HHmmss"),
+            (r"^\d{8}$", "yyyyMMdd"),
+        ]
 
-    parsed_col = lit(None)
-    for pattern, fmt in timestamp_patterns:
-        parsed_col = coalesce(
-            parsed_col,
-            when(col("timestamp_raw").rlike(pattern),
-                 to_timestamp(col("timestamp_raw"), fmt))
-        )
+        parsed_col = lit(None)
+        for pattern, fmt in timestamp_patterns:
+            parsed_col = coalesce(
+                parsed_col,
+                when(col("timestamp_raw").rlike(pattern),
+                     to_timestamp(col("timestamp_raw"), fmt))
+            )
 
-    df_struct_good = df_struct_good.withColumn("timestamp_parsed", parsed_col)
+        df_struct_good = df_struct_good.withColumn("timestamp_parsed", parsed_col)
 
-    timestamp_invalid = df_struct_good.filter(col("timestamp_parsed").isNull()) \
-        .withColumn("reject_reason", lit("INVALID_TIMESTAMP_FORMAT"))
+        timestamp_invalid = df_struct_good.filter(col("timestamp_parsed").isNull()) \
+            .withColumn("reject_reason", lit("INVALID_TIMESTAMP_FORMAT"))
 
-    df_struct_good = df_struct_good.filter(col("timestamp_parsed").isNotNull())
+        df_struct_good = df_struct_good.filter(col("timestamp_parsed").isNotNull())
 
 
     
-    # 11. Clean numeric fields
-    
-    def clean_currency(df, name):
-        df = df.withColumn(name, regexp_replace(col(name), "[^0-9()\\.-]", ""))
-        df = df.withColumn(name, regexp_replace(col(name), "[(]", "-"))
-        df = df.withColumn(name, regexp_replace(col(name), "[)]", ""))
-        return df.withColumn(name, col(name).cast("double"))
+        # 11. Clean numeric fields (locale-aware, single pass per column)
+        #
+        # Each column is validated with one anchored regex for the file's locale and
+        # then normalised with one translate() + cast. Values that do not match the
+        # expected shape become INVALID_NUMERIC_FORMAT rejects instead of silent nulls
+        # (or, worse, "1.234,56" being read as 1.23456).
+
+        def detect_decimal_separator(lines, delim):
+            # With a comma delimiter an unquoted decimal comma cannot survive the split
+            if delim == ",":
+                return "."
+            votes = {".": 0, ",": 0}
+            idxs = [index_map[c] for c in ("unit_price", "revenue") if c in index_map]
+            for line in lines[1:]:
+                parts = line.split(delim)
+                for i in idxs:
+                    v = parts[i].strip() if i < len(parts) else ""
+                    if re.search(r"\d,\d{1,2}\D*$", v) or re.search(r"\d\.\d{3},", v):
+                        votes[","] += 1
+                    elif re.search(r"\d\.\d{1,2}\D*$", v) or re.search(r"\d,\d{3}\.", v):
+                        votes["."] += 1
+            return "," if votes[","] > votes["."] else "."
+
+        decimal_sep = detect_decimal_separator(sample_lines, delimiter)
+        thousands_sep = "." if decimal_sep == "," else ","
+        print(f"Detected numeric locale: decimal='{decimal_sep}' thousands='{thousands_sep}'")
+
+        currency_chars = "$€£¥"
+        d, t = re.escape(decimal_sep), re.escape(thousands_sep)
+        grouped = f"(?:\\d{{1,3}}(?:{t}\\d{{3}})+|\\d+)"
+        amount = f"[{currency_chars}]?\\s*-?(?:{grouped}(?:{d}\\d+)?|{d}\\d+)\\s*[{currency_chars}]?"
+        decimal_pattern = f'^"?\\s*(?:-?\\s*{amount}|\\(\\s*{amount}\\s*\\))\\s*"?$'
+        integer_pattern = f'^"?\\s*-?{grouped}(?:{d}0+)?\\s*"?$'
+
+        # translate(): "(" -> "-", decimal separator -> ".", everything else listed is dropped
+        translate_from = "(" + decimal_sep + thousands_sep + currency_chars + ') "'
+        translate_to = "-."
+
+        def parse_number(name, pattern, dtype):
+            c = col(name)
+            return when(c.rlike(pattern), translate(c, translate_from, translate_to).cast(dtype))
+
+        df_struct_good = df_struct_good \
+            .withColumn("unit_price_num", parse_number("unit_price", decimal_pattern, "double")) \
+            .withColumn("revenue_num", parse_number("revenue", decimal_pattern, "double")) \
+            .withColumn("quantity_num", parse_number("quantity", integer_pattern, "int"))
+
+        numeric_invalid_cond = (
+            col("unit_price_num").isNull() |
+            col("revenue_num").isNull() |
+            col("quantity_num").isNull()
+        )
+
+        numeric_invalid = df_struct_good.filter(numeric_invalid_cond) \
+            .withColumn("reject_reason", lit("INVALID_NUMERIC_FORMAT"))
 
-    df_struct_good = clean_currency(df_struct_good, "unit_price")
-    df_struct_good = clean_currency(df_struct_good, "revenue")
-    df_struct_good = df_struct_good.withColumn("quantity", regexp_replace(col("quantity"), "[^0-9-]", "").cast("int"))
+        df_struct_good = df_struct_good.filter(~numeric_invalid_cond) \
+            .withColumn("unit_price", col("unit_price_num")) \
+            .withColumn("revenue", col("revenue_num")) \
+            .withColumn("quantity", col("quantity_num")) \
+            .drop("unit_price_num", "revenue_num", "quantity_num")
 
 
     
-    # 12. Add metadata
+        # 12. Add metadata
     
-    df_struct_good = df_struct_good.withColumn("timestamp", col("timestamp_parsed"))
-    df_struct_good = df_struct_good.withColumn("ingest_run_id", lit(ingest_run_id))
-    df_struct_good = df_struct_good.withColumn("source_file", lit(source_file))
-    df_struct_good = df_struct_good.withColumn("ingest_ts", current_timestamp())
-    df_struct_good = df_struct_good.withColumn("date", to_date(col("timestamp")))
-    df_struct_good = df_struct_good.dropDuplicates()
+        df_struct_good = df_struct_good.withColumn("timestamp", col("timestamp_parsed"))
+        df_struct_good = df_struct_good.withColumn("ingest_run_id", lit(ingest_run_id))
+        if source_file_from_path:
+            # input_file_name() is a URI (space -> %20, % -> %25) with "+" left literal, so
+            # "+" is escaped before URLDecoder (which would turn it into a space) decodes it.
+            # Then <source_file> or <source_file>__part-NNNNN.csv for split files.
+            input_key = expr("reflect('java.net.URLDecoder', 'decode', replace(input_file, '+', '%2B'), 'UTF-8')")
+            df_struct_good = df_struct_good.withColumn(
+                "source_file", regexp_extract(input_key, r"([^/]+?)(?:__part-\d{5}\.csv)?$", 1))
+        else:
+            df_struct_good = df_struct_good.withColumn("source_file", lit(source_file))
+        df_struct_good = df_struct_good.drop("input_file")
+        df_struct_good = df_struct_good.withColumn("ingest_ts", current_timestamp())
+        df_struct_good = df_struct_good.withColumn("date", to_date(col("timestamp")))
+        df_struct_good = df_struct_good.dropDuplicates()
 
 
     
-    # 13. Business DQ rules
+        # 13. Business DQ rules
     
-    dq_cond = (
-        col("timestamp").isNull() |
-        (abs(col("revenue") - (col("quantity") * col("unit_price"))) > 0.01)
-    )
+        dq_cond = (
+            col("timestamp").isNull() |
+            (abs(col("revenue") - (col("quantity") * col("unit_price"))) > 0.01)
+        )
 
-    df_dq_bad  = df_struct_good.filter(dq_cond)
-    df_dq_good = df_struct_good.filter(~dq_cond)
+        df_dq_bad  = df_struct_good.filter(dq_cond)
+        df_dq_good = df_struct_good.filter(~dq_cond)
 
 
     
-    # 14. Align reject schemas (no mismatch)
+        # 14. Align reject schemas (no mismatch)
     
-    reject_columns = [
-        "raw_row",
-        "transaction_id",
-        "store_id",
-        "timestamp_raw",
-        "timestamp_parsed",
-        "item_id",
-        "item_category",
-        "quantity",
-        "unit_price",
-        "revenue",
-        "payment_method",
-        "customer_id",
-        "reject_reason"
-    ]
+        reject_columns = [
+            "raw_row",
+            "transaction_id",
+            "store_id",
+            "timestamp_raw",
+            "timestamp_parsed",
+            "item_id",
+            "item_category",
+            "quantity",
+            "unit_price",
+            "revenue",
+            "payment_method",
+            "customer_id",
+            "reject_reason"
+        ]
+
+        def align_reject_schema(df):
+            out = df
+            for col_name in reject_columns:
+                if col_name not in df.columns:
+                    out = out.withColumn(col_name, lit(None))
+            return out.select(reject_columns)
+
+        struct_rejects_aligned = align_reject_schema(struct_rejects)
+        timestamp_invalid_aligned = align_reject_schema(timestamp_invalid)
+        numeric_invalid_aligned = align_reject_schema(numeric_invalid)
+
+        dq_rejects = df_dq_bad.withColumn("raw_row", lit(None)) \
+                              .withColumn("reject_reason", lit("BUSINESS_LOGIC_FAIL"))
+
+        dq_rejects_aligned = align_reject_schema(dq_rejects)
+
+        rejects_df = (
+            struct_rejects_aligned
+            .unionByName(timestamp_invalid_aligned)
+            .unionByName(numeric_invalid_aligned)
+            .unionByName(dq_rejects_aligned)
+        )
 
-    def align_reject_schema(df):
-        out = df
-        for col_name in reject_columns:
-            if col_name not in df.columns:
-                out = out.withColumn(col_name, lit(None))
-        return out.select(reject_columns)
 
-    struct_rejects_aligned = align_reject_schema(struct_rejects)
-    timestamp_invalid_aligned = align_reject_schema(timestamp_invalid)
+        # 14b. Row counts + column profile in one aggregation pass
+        #
+        # Every extracted row is classified with the same conditions as steps 9-11
+        # and fanned out to one (dim, val) pair per profiled category plus "_all";
+        # a single groupBy then yields the per-class counts, top-k values and the
+        # timestamp-format histogram, and (on "_all") the global statistics. This
+        # replaces the separate count() per reject type; the good / business-rule
+        # split is counted after dropDuplicates in one more aggregation.
+
+        ts_format_col = lit(None).cast("string")
+        for pattern, fmt in timestamp_patterns:
+            ts_format_col = coalesce(ts_format_col, when(col("timestamp_raw").rlike(pattern), lit(fmt)))
+
+        profile_base = df_extracted \
+            .withColumn("timestamp_parsed", parsed_col) \
+            .withColumn("unit_price_num", parse_number("unit_price", decimal_pattern, "double")) \
+            .withColumn("revenue_num", parse_number("revenue", decimal_pattern, "double")) \
+            .withColumn("quantity_num", parse_number("quantity", integer_pattern, "int")) \
+            .withColumn("ts_format",
+                        when(col("timestamp_raw").isNull(), lit("MISSING"))
+                        .when(ts_format_col.isNull(), lit("UNMATCHED"))
+                        .when(col("timestamp_parsed").isNull(), concat(lit("UNPARSEABLE:"), ts_format_col))
+                        .otherwise(ts_format_col)) \
+            .withColumn("row_class",
+                        when(missing_req_cond, lit("missing_required"))
+                        .when(col("timestamp_parsed").isNull(), lit("invalid_timestamp"))
+                        .when(numeric_invalid_cond, lit("invalid_numeric"))
+                        .otherwise(lit("structurally_good")))
+
+        dims = (PROFILE_CATEGORICAL + ["ts_format"]) if profile_enabled else []
+        fanned = profile_base.select("*", explode(array(
+            *[struct(lit(d).alias("dim"), col(d).cast("string").alias("val")) for d in dims + ["row_class"]],
+            struct(lit("_all").alias("dim"), lit(None).cast("string").alias("val"))
+        )).alias("g"))
+
+        is_all = col("g.dim") == "_all"
+        profile_aggs = [count(lit(1)).alias("rows")]
+        if profile_enabled:
+            for c in PROFILE_NULLABLE:
+                empty = col(c).isNull() | (trim(col(c)) == "")
+                profile_aggs.append(sum(when(is_all & empty, 1).otherwise(0)).alias(f"{c}__nulls"))
+            for c in PROFILE_DISTINCT:
+                profile_aggs.append(approx_count_distinct(when(is_all, col(c))).alias(f"{c}__distinct"))
+            for c, num_col in PROFILE_NUMERIC.items():
+                profile_aggs += [
+                    min(when(is_all, col(num_col))).alias(f"{c}__min"),
+                    max(when(is_all, col(num_col))).alias(f"{c}__max"),
+                    avg(when(is_all, col(num_col))).alias(f"{c}__mean"),
+                ]
+            profile_aggs += [
+                min(when(is_all, col("timestamp_parsed"))).alias("timestamp__min"),
+                max(when(is_all, col("timestamp_parsed"))).alias("timestamp__max"),
+            ]
+
+        profile_rows = [r.asDict() for r in fanned.groupBy(col("g.dim").alias("dim"), col("g.val").alias("val"))
+                        .agg(*profile_aggs).collect()]
+        class_counts = {r["val"]: r["rows"] for r in profile_rows if r["dim"] == "row_class"}
+
+        dq_split = df_struct_good.agg(
+            count(lit(1)).alias("rows"),
+            sum(when(dq_cond, 1).otherwise(0)).alias("bad")
+        ).first()
+
+        counts = {
+            "good": dq_split["rows"] - (dq_split["bad"] or 0),
+            "missing_required": class_counts.get("missing_required", 0),
+            "invalid_timestamp": class_counts.get("invalid_timestamp", 0),
+            "invalid_numeric": class_counts.get("invalid_numeric", 0),
+            "business_logic": dq_split["bad"] or 0,
+        }
+
+        profile, drift = None, []
+        data_rows = builtins.sum(class_counts.values())
+        if profile_enabled and data_rows:
+            profile = build_profile(profile_rows, data_rows)
+            drift = detect_drift(profile, load_json(f"{profile_prefix}baseline.json"))
+            profile["drift"] = drift
+            profile["spark_settings"] = spark_settings
+            for flag in drift:
+                print(f"[WARN] Drift: {flag['check']} on {flag['column']}: {flag['detail']}")
+
+        reject_count = counts["missing_required"] + counts["invalid_timestamp"] + \
+            counts["invalid_numeric"] + counts["business_logic"]
 
-    dq_rejects = df_dq_bad.withColumn("raw_row", lit(None)) \
-                          .withColumn("reject_reason", lit("BUSINESS_LOGIC_FAIL"))
 
-    dq_rejects_aligned = align_reject_schema(dq_rejects)
 
-    rejects_df = (
-        struct_rejects_aligned
-        .unionByName(timestamp_invalid_aligned)
-        .unionByName(dq_rejects_aligned)
-    )
+    
+        # 15. Write rejects + GOOD rows to the run's staging area
+   
+        if reject_count > 0:
+            rejects_df.write.mode("overwrite").json(f"{staging_path}rejects_json/")
+            rejects_df.coalesce(1).write.mode("overwrite").option("header", True).csv(f"{staging_path}rejects_csv/")
+
+        if spark_settings:
+            # Merges the deduplicated partitions without another shuffle
+            df_dq_good = df_dq_good.coalesce(spark_settings["write_partitions"])
+        df_dq_good.write.mode("overwrite").partitionBy("date").parquet(f"{staging_path}processed/")
+
+        mark_stage("staged", counts=counts, profile=profile, spark_settings=spark_settings)
 
-    reject_count = rejects_df.count()
-    good_count   = df_dq_good.count()
+    counts       = checkpoint["stages"]["staged"]["counts"]
+    good_count   = counts["good"]
+    reject_count = counts["missing_required"] + counts["invalid_timestamp"] + \
+        counts["invalid_numeric"] + counts["business_logic"]
     total_rows   = good_count + reject_count
+    profile      = checkpoint["stages"]["staged"].get("profile")
+    drift        = (profile or {}).get("drift", [])
+
+
+   
+    # 16. Commit staged outputs to processed/ + rejected/data_quality/
+    
+    if not stage_done("committed"):
+        committed_files = commit_staged()
+        mark_stage("committed", files=committed_files, manifest=manifest_key)
+
 
+    
+    # 17. Archive validated file — NOW with timestamp + ingest_id
+    
+    if not stage_done("archived") and not archive_input:
+        delete_keys(list_input_keys())
+        mark_stage("archived", archive_key=None)
+
+    if not stage_done("archived"):
+        timestamp_now = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
+        archive_filename = f"{source_file}_{timestamp_now}_{ingest_run_id}"
+        archive_key = f"archive/validated/{archive_filename}"
+
+        move_input(archive_key)
+        mark_stage("archived", archive_key=archive_key)
 
 
     
-    # 15. Write rejects
-   
-    if reject_count > 0:
-        rejects_df.write.mode("append").json(dq_json_path)
-        rejects_df.coalesce(1).write.mode("append").option("header", True).csv(dq_csv_path)
+    # 17b. Store the column profile and fold it into the rolling baseline
+    #      (only for committed + archived runs, so failed attempts never skew the baseline)
+    
+    if profile and not stage_done("profiled"):
+        profile_day = profile["created_at"][:10]
+        profile_key = f"{profile_prefix}date={profile_day}/{ingest_run_id}.json"
+        s3.put_object(Bucket=bucket_name, Key=profile_key,
+                      Body=json.dumps(profile, separators=(",", ":"), default=str).encode("utf-8"))
+        baseline_key = f"{profile_prefix}baseline.json"
+        baseline = update_baseline(load_json(baseline_key), profile)
+        s3.put_object(Bucket=bucket_name, Key=baseline_key,
+                      Body=json.dumps(baseline, separators=(",", ":")).encode("utf-8"))
+        mark_stage("profiled", profile_key=profile_key, drift_flags=len(drift))
 
 
    
-    # 16. SNS Summary
+    # 18. SNS Summary (after commit, so it only reports data that landed)
     
-    if sns_topic:
+    if not stage_done("notified"):
         msg = (
             f"FILE: {source_file}\n\n"
             f"Total Rows: {total_rows}\n"
             f"Good Rows: {good_count}\n"
             f"Rejected Rows: {reject_count}\n\n"
             f"Breakdown:\n"
-            f" - Missing Required Columns: {struct_rejects_aligned.count()}\n"
-            f" - Invalid Timestamps: {timestamp_invalid_aligned.count()}\n"
-            f" - Business Logic Rejects: {dq_rejects_aligned.count()}\n"
-        )
-        sns_client.publish(
-            TopicArn=sns_topic,
-            Subject="DATA QUALITY REPORT",
-            Message=msg
+            f" - Missing Required Columns: {counts['missing_required']}\n"
+            f" - Invalid Timestamps: {counts['invalid_timestamp']}\n"
+            f" - Invalid Numerics: {counts['invalid_numeric']}\n"
+            f" - Business Logic Rejects: {counts['business_logic']}\n"
         )
+        if drift:
+            msg += "\nDrift vs baseline:\n" + "".join(
+                f" - {f['check']} on {f['column']}: {f['detail']}\n" for f in drift)
+        publish_alert("DATA QUALITY REPORT", msg,
+                      metrics=dict(counts, files=1, total_rows=total_rows, rejected_rows=reject_count,
+                                   drift_flags=len(drift)))
+        mark_stage("notified")
 
 
     
-    # 17. Write GOOD rows to processed
-    
-    processed_path = output_path
-    df_dq_good.write.mode("append").partitionBy("date").parquet(processed_path)
-
-
-   
-    # 18. Archive validated file — NOW with timestamp + ingest_id
+    # 19. Finish successfully (staged data is dropped; the checkpoint is kept
+    #     until the compaction job's staging GC so a duplicate run of the same
+    #     ingest_run_id is a no-op)
     
-    timestamp_now = datetime.datetime.utcnow().strftime("%Y%m%dT%H%M%S")
-    archive_filename = f"{source_file}_{timestamp_now}_{ingest_run_id}"
-    archive_key = f"archive/validated/{archive_filename}"
+    delete_keys([k for k in list_keys(staging_key) if k != checkpoint_key])
 
-    s3.copy_object(
-        Bucket=bucket_name,
-        CopySource={"Bucket": bucket_name, "Key": validated_key},
-        Key=archive_key
-    )
-    s3.delete_object(Bucket=bucket_name, Key=validated_key)
-
-
-    
-    # 19. Finish successfully
-    
     job.commit()
     print("Job completed successfully.")
 
@@ -421,23 +1007,38 @@ try:
 except Exception as e:
 
     print("CRITICAL ERROR:", str(e))
+
+    # RETRY: keep input, staged data and checkpoint so the next attempt resumes
+    if checkpoint["attempts"] < max_attempts:
+        print(f"Attempt {checkpoint['attempts']}/{max_attempts} failed; keeping staged data for resume.")
+        try:
+            checkpoint["last_error"] = str(e)
+            save_checkpoint()
+        except Exception as ckpt_err:
+            print(f"[WARN] Failed to save checkpoint: {ckpt_err}")
+        raise e
+
+    # Committed and archived: the data is complete, only a later stage failed
+    if stage_done("archived"):
+        print("Run is committed and archived; keeping its data. Only the failed stage is missing.")
+        raise e
+
     print("Moving file to rejected/system and cleaning partially written data...")
 
-    # CLEANUP: DELETE partially written processed partition
+    # CLEANUP: remove committed (or partially copied) files, so a replay of the
+    # rejected file does not duplicate them
     try:
-        date_partitions = spark.sql("SELECT DISTINCT date FROM df_struct_good").collect()
-        for row in date_partitions:
-            if row.date:
-                bad_path = f"{output_path}/date={row.date}"
-                try:
-                    s3.delete_object(Bucket=bucket_name, Key=bad_path)
-                except:
-                    pass
-    except:
-        pass
+        rollback_commit()
+    except Exception as cleanup_err:
+        print(f"[WARN] Rollback of committed files failed: {cleanup_err}")
 
     # Move file to system reject
     move_to_system_reject(str(e))
 
+    try:
+        delete_keys(list_keys(staging_key))
+    except Exception as cleanup_err:
+        print(f"[WARN] Failed to clean staging prefix {staging_key}: {cleanup_err}")
+
     # Fail job
     raise e
@@ -8,21 +8,39 @@
 #   --max_partitions  optional int, max partitions to process in one run (default 50)
 #   --reprocess       optional "true" to recompact partitions already present in gold (default false)
 #   --force_dates     optional comma-separated YYYY-MM-DD list to force process those dates (overrides detection)
+#   --auto_tune       optional "false" to keep Glue's default Spark settings (default true)
+#   --target_partition_mb optional int, target shuffle partition / output file size in MB (default 128)
+#   --skip_unchanged  optional "false" to rewrite partitions whose input is unchanged (default true)
+#   --catalog_database / --catalog_table  optional Glue Data Catalog table to register written partitions in
+#   --catalog_local_path optional JSON file used as a local catalog stand-in instead of the Glue API
+#   --crawler_name    optional crawler; started only when no catalog table is given or registration fails
+#   --staging_path    optional ETL staging prefix to garbage-collect (default s3://<processed bucket>/staging/, "none" to disable)
+#   --staging_ttl_hours optional idle age after which an ETL run's staging data is deleted (default 24)
 #
 # Behavior:
 #  - Finds processed partitions of the form: processed/.../date=YYYY-MM-DD/
+#  - Reads only files of committed ETL runs (<ingest_run_id>__* files need processed/_manifests/<ingest_run_id>.json)
 #  - If force_dates provided: processes exactly those dates (if found in processed)
 #  - Else computes partitions_to_process = processed_dates - gold_dates (unless reprocess=true)
 #  - Processes partitions in ascending date order (oldest first)
 #  - Writes each partition to gold_path/date=YYYY-MM-DD/ (overwrite)
 #  - Emits per-partition audit JSON to audit_path/gold_compaction/date=YYYY-MM-DD/metrics.json
+#  - Sizes shuffle partitions, AQE, broadcast threshold and output file count from each
+#    partition's input size (S3 listing) and records them in the partition metrics
+#  - Skips partitions whose input fingerprint matches the last written metrics:
+#    file list (key/size/ETag) first, metadata only; then an order-independent
+#    aggregate of the row hashes if only the file list changed
+#  - Registers/updates exactly the written partitions in the catalog table (batched partition
+#    API calls, columns from the written Parquet footers); the crawler is only a fallback
+#  - Deletes ETL staging prefixes (checkpoints, leftovers of failed runs) idle longer than staging_ttl_hours
 #  - Job is idempotent: re-running same date will overwrite the partition
 
 import sys
 import json
 import re
 import boto3
-from datetime import datetime
+import hashlib
+from datetime import datetime, timedelta, timezone
 from urllib.parse import urlparse
 
 from awsglue.context import GlueContext
@@ -58,15 +76,31 @@ audit_path = args["audit_path"].rstrip("/") + "/"
 # optional args via getResolvedOptions would raise if listed; so parse from sys.argv manual fallback
 def get_optional(arg_name, default=None):
     prefix = f"--{arg_name}="
-    for a in sys.argv:
+    for i, a in enumerate(sys.argv):
         if a.startswith(prefix):
             return a.split("=", 1)[1]
+        # Glue passes job arguments as separate "--name value" tokens
+        if a == f"--{arg_name}" and i + 1 < len(sys.argv):
+            return sys.argv[i + 1]
     return default
 
 max_partitions = int(get_optional("max_partitions", "10"))
 reprocess_flag = get_optional("reprocess", "false").lower() == "true"
 force_dates_arg = get_optional("force_dates", "").strip()  # comma separated
 force_dates = [d.strip() for d in force_dates_arg.split(",") if d.strip()] if force_dates_arg else []
+auto_tune = get_optional("auto_tune", "true").lower() == "true"
+target_partition_mb = int(get_optional("target_partition_mb", "128"))
+skip_unchanged = get_optional("skip_unchanged", "true").lower() == "true"
+catalog_database = get_optional("catalog_database")
+catalog_table = get_optional("catalog_table")
+catalog_local_path = get_optional("catalog_local_path")
+crawler_name = get_optional("crawler_name", None)
+staging_path = get_optional("staging_path", f"s3://{urlparse(processed_path).netloc}/staging/")
+staging_ttl_hours = int(get_optional("staging_ttl_hours", "24"))
+
+# Part of every fingerprint: bump when the compaction logic changes so that
+# previously written partitions are no longer considered up to date.
+COMPACTION_VERSION = "1"
 
 
 # Init clients & Spark
@@ -105,13 +139,13 @@ def list_partition_dates(s3_path):
         for cp in cps:
             p = cp.get("Prefix", "")
             # find date=YYYY-MM-DD/ in p
-            m = re.search(r"date=(\\d{4}-\\d{2}-\\d{2})/", p)
+            m = re.search(r"date=(\d{4}-\d{2}-\d{2})/", p)
             if m:
                 dates.add(m.group(1))
         # Additionally scan object keys if no CommonPrefixes discovered
         for obj in page.get("Contents", []):
             key = obj.get("Key", "")
-            m = re.search(r"date=(\\d{4}-\\d{2}-\\d{2})/", key)
+            m = re.search(r"date=(\d{4}-\d{2}-\d{2})/", key)
             if m:
                 dates.add(m.group(1))
 
@@ -125,6 +159,179 @@ def partition_exists(s3_path, date_str):
     resp = s3.list_objects_v2(Bucket=bucket, Prefix=key_prefix, MaxKeys=1)
     return "Contents" in resp
 
+def list_partition_objects(s3_path, date_str):
+    """Return [(key, size, etag)] of the data files under s3_path/date=YYYY-MM-DD/ (Spark markers skipped)."""
+    parsed = urlparse(s3_path)
+    bucket = parsed.netloc
+    key_prefix = f"{parsed.path.lstrip('/')}date={date_str}/"
+    objects = []
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=key_prefix):
+        for obj in page.get("Contents", []):
+            if not obj["Key"].split("/")[-1].startswith(("_", ".")):
+                objects.append((obj["Key"], obj["Size"], obj.get("ETag", "").strip('"')))
+    return objects
+
+# The ETL copies a run's files to processed/ as "<ingest_run_id>__part-..." and
+# writes processed/_manifests/<ingest_run_id>.json last. Files of a run without a
+# manifest are mid-commit (or being rolled back) and are left out; files without
+# a run prefix predate staged commits and are always read.
+RUN_FILE_RE = re.compile(r"^([0-9A-Za-z]+)__")
+
+def file_run_id(key):
+    m = RUN_FILE_RE.match(key.split("/")[-1])
+    return m.group(1) if m else None
+
+def committed_objects(s3_path, objects):
+    """Drop the files of ETL runs that have no manifest yet."""
+    parsed = urlparse(s3_path)
+    manifest_prefix = f"{parsed.path.lstrip('/')}_manifests/"
+    runs = {file_run_id(key) for key, _, _ in objects} - {None}
+    committed = {r for r in runs if "Contents" in s3.list_objects_v2(
+        Bucket=parsed.netloc, Prefix=f"{manifest_prefix}{r}.json", MaxKeys=1)}
+    if runs - committed:
+        print(f"[INFO] Ignoring files of uncommitted ETL runs: {sorted(runs - committed)}")
+    return [o for o in objects if file_run_id(o[0]) in committed or file_run_id(o[0]) is None]
+
+
+# ETL staging GC
+#
+# Every ETL run keeps staging/<ingest_run_id>/_checkpoint.json after success so a
+# duplicate run of the same id is a no-op, and a run that failed for good may leave
+# staged outputs behind. They are deleted here, once per compaction run, from a
+# single flat listing of the staging prefix instead of one listing per run.
+
+def gc_staging(s3_path, ttl_hours):
+    """Delete the run prefixes under s3_path whose newest object is older than ttl_hours."""
+    parsed = urlparse(s3_path)
+    bucket = parsed.netloc
+    root = parsed.path.lstrip("/").rstrip("/") + "/"
+    cutoff = datetime.now(timezone.utc) - timedelta(hours=ttl_hours)
+    runs = {}  # run prefix -> (keys, newest LastModified)
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=root):
+        for obj in page.get("Contents", []):
+            run, sep, _ = obj["Key"][len(root):].partition("/")
+            if not sep:
+                continue
+            keys, newest = runs.get(run, ([], obj["LastModified"]))
+            keys.append(obj["Key"])
+            runs[run] = (keys, max(newest, obj["LastModified"]))
+    deleted = 0
+    for run, (keys, newest) in sorted(runs.items()):
+        if newest >= cutoff:
+            continue
+        print(f"[INFO] GC idle staging prefix: {root}{run}/ ({len(keys)} objects)")
+        for i in range(0, len(keys), 1000):
+            s3.delete_objects(Bucket=bucket, Delete={"Objects": [{"Key": k} for k in keys[i:i + 1000]], "Quiet": True})
+        deleted += 1
+    return deleted
+
+
+# Spark settings sized from the partition's input
+#
+# Glue starts with 200 shuffle partitions regardless of input, so a 100 KB day
+# pays 200-task shuffles in the dedup window and sort while a 20 GB backfill day
+# spills. Session-level SQL settings are re-planned per partition from the S3
+# listing before its plan is built; executor count and memory stay as configured.
+
+PARQUET_EXPANSION = 3.0   # rough in-memory bytes per snappy Parquet byte
+
+def plan_spark_settings(input_bytes):
+    target = target_partition_mb * 1024 * 1024
+    cores = sc.defaultParallelism
+    splits = max(1, -(-int(input_bytes * PARQUET_EXPANSION) // target))
+    # Small inputs get one shuffle partition per target-sized split; anything
+    # larger than one split uses at least every core. AQE coalesces further.
+    shuffle_partitions = splits if splits == 1 else max(splits, cores)
+    # A side up to 1% of the in-memory input (10 MB - 128 MB) may be broadcast
+    broadcast = min(max(int(input_bytes * PARQUET_EXPANSION) // 100, 10 * 1024 * 1024), 128 * 1024 * 1024)
+    return {
+        "input_bytes": input_bytes,
+        "cores": cores,
+        "write_partitions": max(1, -(-input_bytes // target)),
+        "spark.sql.shuffle.partitions": shuffle_partitions,
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": target,
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": broadcast,
+        "spark.sql.files.maxPartitionBytes": target,
+    }
+
+# Partition fingerprints
+#
+# files_fingerprint: hash of the sorted (key, size, ETag) list - a pure metadata
+# check that needs no data read. content_fingerprint: row count plus two sums
+# over md5(transaction_id, row_hash, ingest_ts) - order independent, so rewritten
+# or re-split input files with the same rows still match. Both are stored in the
+# partition metrics of every written partition.
+
+def files_fingerprint(objects):
+    listing = "\n".join(f"{key}|{size}|{etag}" for key, size, etag in sorted(objects))
+    return hashlib.md5(f"v{COMPACTION_VERSION}\n{listing}".encode("utf-8")).hexdigest()
+
+def content_fingerprint_aggs(df):
+    """Aggregations (combined with the row count pass) for the content fingerprint."""
+    h = md5(concat_ws("||", coalesce(col("transaction_id").cast(StringType()), lit("")),
+                      col("row_hash"), coalesce(col("ingest_ts").cast(StringType()), lit(""))))
+    # two 60-bit slices of each row digest, summed exactly as decimals
+    return [
+        F.sum(F.conv(F.substring(h, 1, 15), 16, 10).cast("decimal(38,0)")).alias("fp_a"),
+        F.sum(F.conv(F.substring(h, 16, 15), 16, 10).cast("decimal(38,0)")).alias("fp_b"),
+    ]
+
+def content_fingerprint(row_count, agg_row):
+    return f"v{COMPACTION_VERSION}:{row_count}:{agg_row['fp_a'] or 0}:{agg_row['fp_b'] or 0}"
+
+def metrics_key(date_str):
+    parsed_audit = urlparse(audit_path)
+    audit_prefix = parsed_audit.path.lstrip("/").rstrip("/")
+    key = f"gold_compaction/date={date_str}/metrics.json"
+    return parsed_audit.netloc, f"{audit_prefix}/{key}" if audit_prefix else key
+
+def load_previous_metrics(date_str):
+    bucket, key = metrics_key(date_str)
+    try:
+        return json.loads(s3.get_object(Bucket=bucket, Key=key)["Body"].read())
+    except s3.exceptions.NoSuchKey:
+        return None
+    except Exception as e:
+        print(f"[WARN] Could not read previous metrics for date={date_str}: {e}")
+        return None
+
+def write_metrics(date_str, metrics):
+    try:
+        bucket, key = metrics_key(date_str)
+        s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(metrics).encode("utf-8"))
+        print(f"[INFO] Wrote metrics to s3://{bucket}/{key}")
+    except Exception as e:
+        print(f"[ERROR] Failed to write audit metrics for date={date_str}: {e}")
+
+def mark_unchanged(previous, date_str, files_fp, check):
+    """Carry the last written metrics forward for a skipped partition."""
+    metrics = dict(previous)
+    metrics.update({
+        "status": "skipped_unchanged",
+        "skip_check": check,
+        "files_fingerprint": files_fp,
+        "checked_at_utc": datetime.utcnow().isoformat(),
+    })
+    write_metrics(date_str, metrics)
+    print(f"[INFO] Partition date={date_str} unchanged ({check} check). Skipping write.")
+    return metrics
+
+def parquet_columns(s3_path):
+    """Catalog columns of written Parquet (footer-only read); "date" is the partition key."""
+    return [{"Name": f.name, "Type": f.dataType.simpleString()}
+            for f in spark.read.parquet(s3_path).schema.fields if f.name != "date"]
+
+def apply_spark_settings(settings):
+    for name, value in settings.items():
+        if name.startswith("spark."):
+            spark.conf.set(name, str(value))
+    print(f"[INFO] Spark settings: {json.dumps(settings)}")
+
 # Find processed & gold partitions
 
 processed_dates = list_partition_dates(processed_path)
@@ -155,6 +362,12 @@ if len(partitions_to_process) > max_partitions:
 
 print(f"[INFO] Partitions selected for processing: {partitions_to_process}")
 
+if staging_path.lower() != "none":
+    try:
+        print(f"[INFO] Staging GC: {gc_staging(staging_path, staging_ttl_hours)} idle run prefixes deleted")
+    except Exception as e:
+        print(f"[WARN] Staging GC failed: {e}")
+
 if not partitions_to_process:
     print("[INFO] Nothing to process. Exiting.")
     job.commit()
@@ -172,20 +385,33 @@ def compact_partition(date_str):
     print(f"[INFO] Input: {input_partition_path}")
     print(f"[INFO] Output: {output_partition_path}")
 
-    # Validate existence
-    parsed_in = urlparse(input_partition_path)
-    bucket_in = parsed_in.netloc
-    prefix_in = parsed_in.path.lstrip("/")
-    if not prefix_in.endswith("/"):
-        prefix_in = prefix_in + "/"
-    resp = s3.list_objects_v2(Bucket=bucket_in, Prefix=prefix_in, MaxKeys=1)
-    if "Contents" not in resp:
+    # Validate existence (the listing also sizes the Spark settings)
+    input_objects = committed_objects(processed_path, list_partition_objects(processed_path, date_str))
+    if not input_objects:
         print(f"[WARN] No objects found for {input_partition_path}. Skipping.")
         return {"date": date_str, "status": "no_input"}
 
-    # Read partition safely
+    # Unchanged-input skip, step 1: file list only (no data read)
+    files_fp = files_fingerprint(input_objects)
+    previous = None
+    if skip_unchanged and partition_exists(gold_path, date_str):
+        previous = load_previous_metrics(date_str)
+        if previous and previous.get("status") not in ("written", "skipped_unchanged"):
+            previous = None
+        if previous and previous.get("files_fingerprint") == files_fp:
+            return mark_unchanged(previous, date_str, files_fp, "files")
+
+    input_bytes = sum(size for _, size, _ in input_objects)
+    spark_settings = None
+    if auto_tune:
+        spark_settings = plan_spark_settings(input_bytes)
+        apply_spark_settings(spark_settings)
+
+    # Read partition safely (only the committed files listed above)
+    input_bucket = urlparse(processed_path).netloc
     try:
-        df = spark.read.option("mergeSchema", "true").parquet(input_partition_path)
+        df = spark.read.option("mergeSchema", "true").parquet(
+            *[f"s3://{input_bucket}/{key}" for key, _, _ in input_objects])
     except Exception as e:
         print(f"[ERROR] Failed reading partition {input_partition_path}: {e}")
         return {"date": date_str, "status": "read_failed", "error": str(e)}
@@ -201,10 +427,15 @@ def compact_partition(date_str):
         if c not in df.columns:
             df = df.withColumn(c, lit(None).cast(StringType()))
 
-    # Normalize numeric-ish strings (defensive)
-    df = df.withColumn("quantity", F.regexp_replace(col("quantity").cast(StringType()), "[^0-9-]", "").cast("long"))
-    df = df.withColumn("unit_price", F.regexp_replace(col("unit_price").cast(StringType()), "[^0-9.\\-()]", "").cast("double"))
-    df = df.withColumn("revenue", F.regexp_replace(col("revenue").cast(StringType()), "[^0-9.\\-()]", "").cast("double"))
+    # Normalize numeric columns. Processed parquet is already typed by the ETL job,
+    # so only legacy string-typed partitions go through the defensive regex.
+    numeric_targets = {"quantity": ("[^0-9-]", "long"), "unit_price": ("[^0-9.\\-()]", "double"), "revenue": ("[^0-9.\\-()]", "double")}
+    col_types = dict(df.dtypes)
+    for c, (pattern, dtype) in numeric_targets.items():
+        if col_types.get(c) == "string":
+            df = df.withColumn(c, F.regexp_replace(col(c), pattern, "").cast(dtype))
+        else:
+            df = df.withColumn(c, col(c).cast(dtype))
 
     # Compute row_hash
     hash_cols = ["store_id", "timestamp", "item_id", "item_category", "quantity", "unit_price", "revenue", "payment_method", "customer_id"]
@@ -220,9 +451,16 @@ def compact_partition(date_str):
     w = Window.partitionBy("transaction_id").orderBy(desc("ingest_ts_f"))
     df_dedup = df.withColumn("rn", row_number().over(w)).filter(col("rn") == 1).drop("rn", "ingest_ts_parsed", "ingest_ts_f", "compaction_ts")
 
-    # Metrics
+    # Metrics (the row count pass also computes the content fingerprint)
     try:
-        total_rows = int(df.count())
+        count_row = df.agg(F.count(lit(1)).alias("rows"), *content_fingerprint_aggs(df)).first()
+        total_rows = int(count_row["rows"])
+        content_fp = content_fingerprint(total_rows, count_row)
+
+        # Unchanged-input skip, step 2: same rows in a different file list
+        if previous and previous.get("content_fingerprint") == content_fp:
+            return mark_unchanged(previous, date_str, files_fp, "content")
+
         rows_after_dedup = int(df_dedup.count())
     except Exception as e:
         print(f"[ERROR] Counting rows failed for date={date_str}: {e}")
@@ -247,11 +485,16 @@ def compact_partition(date_str):
         "null_timestamp": null_timestamp,
         "null_store": null_store,
         "dq_balance_issues": dq_balance_issues,
+        "input_files": len(input_objects),
+        "input_bytes": input_bytes,
+        "spark_settings": spark_settings,
+        "files_fingerprint": files_fp,
+        "content_fingerprint": content_fp,
         "processed_at_utc": datetime.utcnow().isoformat()
     }
 
     # Write compacted partition (overwrite directory for this partition)
-    coalesce_files = 4
+    coalesce_files = spark_settings["write_partitions"] if spark_settings else 4
     try:
         df_out = df_dedup.orderBy(col("transaction_id")).coalesce(coalesce_files)
         df_out.write.mode("overwrite").parquet(output_partition_path)
@@ -262,16 +505,15 @@ def compact_partition(date_str):
         metrics["error"] = str(e)
         print(f"[ERROR] Failed writing partition {output_partition_path}: {e}")
 
+    # Columns for catalog registration; without them registration reads the footers again
+    if catalog_table and metrics["status"] == "written":
+        try:
+            metrics["catalog_columns"] = parquet_columns(output_partition_path)
+        except Exception as e:
+            print(f"[WARN] Could not read the written schema of {output_partition_path}: {e}")
+
     # Write metrics to audit S3
-    try:
-        parsed_audit = urlparse(audit_path)
-        audit_bucket = parsed_audit.netloc
-        audit_prefix = parsed_audit.path.lstrip("/").rstrip("/")
-        metrics_s3_key = f"{audit_prefix}/gold_compaction/date={date_str}/metrics.json" if audit_prefix else f"gold_compaction/date={date_str}/metrics.json"
-        s3.put_object(Bucket=audit_bucket, Key=metrics_s3_key, Body=json.dumps(metrics).encode("utf-8"))
-        print(f"[INFO] Wrote metrics to s3://{audit_bucket}/{metrics_s3_key}")
-    except Exception as e:
-        print(f"[ERROR] Failed to write audit metrics for date={date_str}: {e}")
+    write_metrics(date_str, metrics)
 
     return metrics
 
@@ -290,6 +532,7 @@ summary = {
     "job_name": JOB_NAME,
     "run_ts_utc": datetime.utcnow().isoformat(),
     "processed_partitions_count": len(partitions_to_process),
+    "skipped_unchanged_count": sum(1 for r in results if r.get("status") == "skipped_unchanged"),
     "results": results
 }
 
@@ -306,11 +549,189 @@ except Exception as e:
 
 
 
-# OPTIONAL: Auto-start Glue crawler after compaction
+# Register written partitions in the Glue Data Catalog
+#
+# Instead of re-crawling the whole gold prefix, the partitions written (or
+# confirmed unchanged) by this run are registered directly: the table is
+# created or extended from the written Parquet columns, partitions are created
+# with BatchCreatePartition and existing ones refreshed with
+# BatchUpdatePartition (100 per call).
+
+PARQUET_INPUT_FORMAT = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetInputFormat"
+PARQUET_OUTPUT_FORMAT = "org.apache.hadoop.hive.ql.io.parquet.MapredParquetOutputFormat"
+PARQUET_SERDE = "org.apache.hadoop.hive.ql.io.parquet.serde.ParquetHiveSerDe"
+TABLE_INPUT_KEYS = ["Name", "Description", "Owner", "Retention", "StorageDescriptor", "PartitionKeys",
+                    "TableType", "Parameters", "ViewOriginalText", "ViewExpandedText"]
+CATALOG_BATCH_SIZE = 100
+
+
+class LocalCatalog:
+    """JSON-file stand-in for the Glue Data Catalog calls used below (tests / local runs)."""
+
+    class exceptions:
+        class EntityNotFoundException(Exception):
+            pass
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path) as f:
+                self.state = json.load(f)
+        except FileNotFoundError:
+            self.state = {"tables": {}, "partitions": {}}
+
+    def _save(self):
+        with open(self.path, "w") as f:
+            json.dump(self.state, f, indent=2)
+
+    def get_table(self, DatabaseName, Name):
+        table = self.state["tables"].get(f"{DatabaseName}.{Name}")
+        if table is None:
+            raise self.exceptions.EntityNotFoundException(f"Table {DatabaseName}.{Name} not found")
+        return {"Table": dict(table, DatabaseName=DatabaseName)}
+
+    def create_table(self, DatabaseName, TableInput):
+        self.state["tables"][f"{DatabaseName}.{TableInput['Name']}"] = TableInput
+        self._save()
+
+    def update_table(self, DatabaseName, TableInput):
+        self.get_table(DatabaseName, TableInput["Name"])
+        self.state["tables"][f"{DatabaseName}.{TableInput['Name']}"] = TableInput
+        self._save()
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        assert len(PartitionInputList) <= CATALOG_BATCH_SIZE
+        parts = self.state["partitions"].setdefault(f"{DatabaseName}.{TableName}", {})
+        errors = []
+        for p in PartitionInputList:
+            key = "/".join(p["Values"])
+            if key in parts:
+                errors.append({"PartitionValues": p["Values"],
+                               "ErrorDetail": {"ErrorCode": "AlreadyExistsException", "ErrorMessage": key}})
+            else:
+                parts[key] = p
+        self._save()
+        return {"Errors": errors}
+
+    def batch_update_partition(self, DatabaseName, TableName, Entries):
+        assert len(Entries) <= CATALOG_BATCH_SIZE
+        parts = self.state["partitions"].setdefault(f"{DatabaseName}.{TableName}", {})
+        for e in Entries:
+            parts["/".join(e["PartitionValueList"])] = e["PartitionInput"]
+        self._save()
+        return {"Errors": []}
+
+    def get_partitions(self, DatabaseName, TableName):
+        return {"Partitions": list(self.state["partitions"].get(f"{DatabaseName}.{TableName}", {}).values())}
+
+
+def storage_descriptor(location, columns):
+    return {
+        "Columns": columns,
+        "Location": location,
+        "InputFormat": PARQUET_INPUT_FORMAT,
+        "OutputFormat": PARQUET_OUTPUT_FORMAT,
+        "SerdeInfo": {"SerializationLibrary": PARQUET_SERDE, "Parameters": {"serialization.format": "1"}},
+        "Compressed": True,
+    }
 
-crawler_name = get_optional("crawler_name", None)
 
-if crawler_name:
+def ensure_table(catalog, columns):
+    """Create the table, or append columns that the written Parquet has and the table lacks."""
+    try:
+        table = catalog.get_table(DatabaseName=catalog_database, Name=catalog_table)["Table"]
+    except catalog.exceptions.EntityNotFoundException:
+        catalog.create_table(DatabaseName=catalog_database, TableInput={
+            "Name": catalog_table,
+            "TableType": "EXTERNAL_TABLE",
+            "Parameters": {"classification": "parquet", "EXTERNAL": "TRUE"},
+            "PartitionKeys": [{"Name": "date", "Type": "string"}],
+            "StorageDescriptor": storage_descriptor(gold_path, columns),
+        })
+        print(f"[INFO] Created catalog table {catalog_database}.{catalog_table}")
+        return columns
+
+    table_columns = table["StorageDescriptor"].get("Columns", [])
+    known = {c["Name"] for c in table_columns}
+    added = [c for c in columns if c["Name"] not in known]
+    if added:
+        table_input = {k: table[k] for k in TABLE_INPUT_KEYS if k in table}
+        table_input["StorageDescriptor"] = dict(table["StorageDescriptor"], Columns=table_columns + added)
+        catalog.update_table(DatabaseName=catalog_database, TableInput=table_input)
+        print(f"[INFO] Added columns to {catalog_database}.{catalog_table}: {[c['Name'] for c in added]}")
+    return table_columns + added
+
+
+def register_partitions(catalog, partitions):
+    """partitions: [(date_str, location, columns)]. Returns created/updated counts and failures."""
+    columns = []
+    for _, _, part_columns in partitions:
+        columns += [c for c in part_columns if c["Name"] not in {k["Name"] for k in columns}]
+    ensure_table(catalog, columns)
+
+    inputs = {d: {"Values": [d], "StorageDescriptor": storage_descriptor(loc, cols)} for d, loc, cols in partitions}
+    dates = sorted(inputs)
+    created, updated, failed = 0, 0, []
+    for i in range(0, len(dates), CATALOG_BATCH_SIZE):
+        batch = dates[i:i + CATALOG_BATCH_SIZE]
+        resp = catalog.batch_create_partition(DatabaseName=catalog_database, TableName=catalog_table,
+                                              PartitionInputList=[inputs[d] for d in batch])
+        existing, batch_failed = [], []
+        for err in resp.get("Errors", []):
+            date_value = err["PartitionValues"][0]
+            if err["ErrorDetail"]["ErrorCode"] == "AlreadyExistsException":
+                existing.append(date_value)
+            else:
+                batch_failed.append({"date": date_value, "error": err["ErrorDetail"].get("ErrorMessage")})
+        failed += batch_failed
+        created += len(batch) - len(existing) - len(batch_failed)
+
+        if existing:
+            resp = catalog.batch_update_partition(
+                DatabaseName=catalog_database, TableName=catalog_table,
+                Entries=[{"PartitionValueList": [d], "PartitionInput": inputs[d]} for d in existing])
+            update_errors = resp.get("Errors", [])
+            failed += [{"date": e["PartitionValueList"][0], "error": e["ErrorDetail"].get("ErrorMessage")}
+                       for e in update_errors]
+            updated += len(existing) - len(update_errors)
+
+    return {"created": created, "updated": updated, "failed": failed}
+
+
+catalog_ok = False
+if catalog_database and catalog_table:
+    try:
+        # Unchanged partitions skipped before catalog registration was enabled (or whose
+        # schema read failed after the write) have no stored columns
+        to_register, unreadable = [], []
+        for r in results:
+            if r.get("status") not in ("written", "skipped_unchanged"):
+                continue
+            columns = r.get("catalog_columns")
+            if not columns:
+                try:
+                    columns = parquet_columns(r["output_partition"])
+                except Exception as e:
+                    print(f"[WARN] Not registering date={r['target_date']}: schema read failed: {e}")
+                    unreadable.append(r["target_date"])
+                    continue
+            to_register.append((r["target_date"], r["output_partition"], columns))
+        catalog = LocalCatalog(catalog_local_path) if catalog_local_path else boto3.client("glue")
+        if to_register:
+            outcome = register_partitions(catalog, to_register)
+            print(f"[INFO] Catalog {catalog_database}.{catalog_table}: created={outcome['created']} "
+                  f"updated={outcome['updated']} failed={outcome['failed']}")
+            catalog_ok = not outcome["failed"] and not unreadable
+        else:
+            print("[INFO] No partitions to register in the catalog.")
+            catalog_ok = not unreadable
+    except Exception as e:
+        print(f"[ERROR] Catalog partition registration failed: {e}")
+
+
+# OPTIONAL: Start Glue crawler as a fallback (no catalog table given, or registration failed)
+
+if crawler_name and not catalog_ok:
     glue_client = boto3.client("glue")
 
     try:
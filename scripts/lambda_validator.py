@@ -3,18 +3,24 @@ import json
 import logging
 import boto3
 import csv
+import time
 import uuid
+import zlib
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from urllib.parse import unquote_plus
+from botocore.config import Config
 from botocore.exceptions import ClientError
 
+# zlib, concurrent.futures and collections are already loaded by `import boto3`,
+# so importing them here (rather than inside the gzip / split / SQS paths) adds
+# nothing to a cold start; see benchmarks/bench_validator_startup.py.
+
 logger = logging.getLogger()
 logger.setLevel(logging.INFO)
 
-s3 = boto3.client("s3")
-sns = boto3.client("sns")
-glue = boto3.client("glue")
-
 # Environment variables
 BUCKET = os.environ.get("BUCKET")  
 RAW_PREFIX = os.environ.get("RAW_PREFIX", "raw/")
@@ -26,6 +32,57 @@ SNS_TOPIC_ARN = os.environ.get("SNS_TOPIC_ARN")
 GLUE_JOB_NAME = os.environ.get("GLUE_JOB_NAME")
 MAX_BYTES_TO_READ = int(os.environ.get("MAX_BYTES_TO_READ", "65536"))
 
+# Large-file splitting (disabled when SPLIT_THRESHOLD_BYTES is 0)
+SPLIT_THRESHOLD_BYTES = int(os.environ.get("SPLIT_THRESHOLD_BYTES", "0"))
+SPLIT_CHUNK_BYTES = int(os.environ.get("SPLIT_CHUNK_BYTES", str(256 * 1024 * 1024)))
+SPLIT_PART_BYTES = max(int(os.environ.get("SPLIT_PART_BYTES", str(16 * 1024 * 1024))), 5 * 1024 * 1024)
+SPLIT_MAX_WORKERS = int(os.environ.get("SPLIT_MAX_WORKERS", "8"))
+SPLIT_PROBE_BYTES = 64 * 1024
+
+# Streaming full-file pre-validation (disabled unless STREAM_VALIDATION=true)
+STREAM_VALIDATION = os.environ.get("STREAM_VALIDATION", "false").lower() == "true"
+STREAM_BLOCK_BYTES = int(os.environ.get("STREAM_BLOCK_BYTES", str(8 * 1024 * 1024)))
+STREAM_MAX_ERROR_RATE = float(os.environ.get("STREAM_MAX_ERROR_RATE", "0.05"))
+STREAM_MIN_ROWS = int(os.environ.get("STREAM_MIN_ROWS", "1000"))
+STREAM_MAX_PROBLEMS = int(os.environ.get("STREAM_MAX_PROBLEMS", "50"))
+STREAM_MAX_LINE_BYTES = int(os.environ.get("STREAM_MAX_LINE_BYTES", str(1024 * 1024)))
+
+# Duplicate-event suppression: "memory" (per warm container), "file", "dynamodb" or "none"
+IDEMPOTENCY_STORE = os.environ.get("IDEMPOTENCY_STORE", "memory").lower()
+IDEMPOTENCY_TABLE = os.environ.get("IDEMPOTENCY_TABLE")
+IDEMPOTENCY_FILE = os.environ.get("IDEMPOTENCY_FILE", "/tmp/validator_idempotency.json")
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+
+# SQS-sourced mode (S3 -> SQS -> Lambda)
+SQS_MAX_WORKERS = int(os.environ.get("SQS_MAX_WORKERS", "4"))
+
+# Glue submission cap (all modes)
+MAX_INFLIGHT_GLUE_RUNS = int(os.environ.get("MAX_INFLIGHT_GLUE_RUNS", "0"))  # 0 = no limit
+GLUE_PENDING_PREFIX = os.environ.get("GLUE_PENDING_PREFIX", "glue_pending/")
+GLUE_SUBMIT_LOCK = os.environ.get("GLUE_SUBMIT_LOCK", "dynamodb" if IDEMPOTENCY_TABLE else "memory").lower()
+GLUE_SUBMIT_LOCK_TABLE = os.environ.get("GLUE_SUBMIT_LOCK_TABLE", IDEMPOTENCY_TABLE)
+GLUE_SUBMIT_LOCK_LEASE_SECONDS = int(os.environ.get("GLUE_SUBMIT_LOCK_LEASE_SECONDS", "60"))
+GLUE_SUBMIT_LOCK_WAIT_SECONDS = int(os.environ.get("GLUE_SUBMIT_LOCK_WAIT_SECONDS", "10"))
+
+# AWS client tuning
+S3_MAX_POOL_CONNECTIONS = int(os.environ.get(
+    "S3_MAX_POOL_CONNECTIONS", str(2 * max(SPLIT_MAX_WORKERS, SQS_MAX_WORKERS, 5))))
+AWS_CONNECT_TIMEOUT = int(os.environ.get("AWS_CONNECT_TIMEOUT", "3"))
+PREWARM_S3_CLIENT = os.environ.get("PREWARM_S3_CLIENT", "true").lower() == "true"
+
+# Alerting (digest mode buffers routine alerts and publishes periodic digests)
+ALERT_MODE = os.environ.get("ALERT_MODE", "immediate").lower()   # immediate | digest
+ALERT_SINK = os.environ.get("ALERT_SINK", "sns").lower()         # sns | local
+ALERT_BUFFER = os.environ.get("ALERT_BUFFER", "s3").lower()      # s3 | memory
+ALERT_PREFIX = os.environ.get("ALERT_PREFIX", "alerts/")
+ALERT_DIGEST_CATEGORIES = [c.strip() for c in os.environ.get(
+    "ALERT_DIGEST_CATEGORIES", "STRUCTURAL REJECT,GLUE START FAILURE,DATA QUALITY REPORT").split(",") if c.strip()]
+ALERT_DIGEST_MAX_COUNT = int(os.environ.get("ALERT_DIGEST_MAX_COUNT", "50"))
+ALERT_DIGEST_MAX_AGE_SECONDS = int(os.environ.get("ALERT_DIGEST_MAX_AGE_SECONDS", "900"))
+ALERT_DIGEST_READ_LIMIT = int(os.environ.get("ALERT_DIGEST_READ_LIMIT", "500"))
+ALERT_DIGEST_DETAIL_LINES = int(os.environ.get("ALERT_DIGEST_DETAIL_LINES", "20"))
+ALERT_MAX_PER_MINUTE = int(os.environ.get("ALERT_MAX_PER_MINUTE", "6"))
+
 REQ_COLS_ENV = os.environ.get("REQUIRED_COLUMNS")
 if REQ_COLS_ENV:
     REQUIRED_COLUMNS = [c.strip() for c in REQ_COLS_ENV.split(",") if c.strip()]
@@ -39,6 +96,57 @@ PREFERRED_DELIMITERS = [",", ";", "\t", "|"]
 
 
 
+# AWS clients
+#
+# Clients are built on first use: SNS is only needed on reject/alert paths and
+# Glue only when a file is submitted, so a cold start no longer pays for all
+# three. Every invocation needs S3, so it is still built during init unless
+# PREWARM_S3_CLIENT=false. S3 keeps its connections alive and sizes its pool for
+# the split/SQS worker threads.
+
+class LazyClient:
+    """boto3 client proxy that builds the real client on first attribute access."""
+
+    def __init__(self, service_name, config):
+        self._service_name = service_name
+        self._config = config
+        self._client = None
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            # boto3.client() is not thread-safe; split/SQS workers may race here
+            with self._lock:
+                if self._client is None:
+                    self._client = boto3.client(self._service_name, config=self._config)
+        return self._client
+
+    def prewarm(self):
+        """Build the client now (during init) instead of on first use."""
+        return self.client
+
+    def __getattr__(self, name):
+        return getattr(self.client, name)
+
+
+s3 = LazyClient("s3", Config(
+    max_pool_connections=S3_MAX_POOL_CONNECTIONS,
+    tcp_keepalive=True,
+    connect_timeout=AWS_CONNECT_TIMEOUT,
+    read_timeout=60,
+    retries={"max_attempts": 5, "mode": "standard"},
+))
+sns = LazyClient("sns", Config(connect_timeout=AWS_CONNECT_TIMEOUT, read_timeout=10,
+                               retries={"max_attempts": 3, "mode": "standard"}))
+glue = LazyClient("glue", Config(connect_timeout=AWS_CONNECT_TIMEOUT, read_timeout=10,
+                                 retries={"max_attempts": 3, "mode": "standard"}))
+
+if PREWARM_S3_CLIENT:
+    s3.prewarm()
+
+
+
 # Helper functions
 
 def now_ts():
@@ -66,12 +174,25 @@ def name_with_option_c(orig_name, tag):
 
 
 def read_object_head(bucket, key, num_bytes=MAX_BYTES_TO_READ):
+    """Return (header sample, gzip_input); gzip is detected by extension or magic bytes."""
     try:
         resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes=0-{num_bytes-1}")
-        return resp["Body"].read()
+        data = resp["Body"].read()
     except ClientError:
         resp = s3.get_object(Bucket=bucket, Key=key)
-        return resp["Body"].read()
+        data = resp["Body"].read()
+    gzip_input = is_gzip(key, data)
+    if gzip_input:
+        # Partial gzip stream: decompress what we have so the header can be sniffed
+        try:
+            data = zlib.decompressobj(16 + zlib.MAX_WBITS).decompress(data, num_bytes)
+        except zlib.error:
+            return b"", gzip_input
+    return data, gzip_input
+
+
+def is_gzip(key, sample=b""):
+    return key.lower().endswith(".gz") or sample[:2] == b"\x1f\x8b"
 
 
 def detect_delimiter_and_header(sample_bytes):
@@ -101,88 +222,1245 @@ def move_s3_object(bucket, source_key, target_key):
     s3.delete_object(Bucket=bucket, Key=source_key)
 
 
+def move_s3_prefix(bucket, source_prefix, target_prefix):
+    paginator = s3.get_paginator("list_objects_v2")
+    for page in paginator.paginate(Bucket=bucket, Prefix=source_prefix):
+        for obj in page.get("Contents", []):
+            rel = obj["Key"][len(source_prefix):]
+            move_s3_object(bucket, obj["Key"], f"{target_prefix}{rel}")
+
+
 def write_reason_json(bucket, key, payload):
     s3.put_object(Bucket=bucket, Key=key, Body=json.dumps(payload).encode("utf-8"))
 
 
-def send_alert(subject, message):
-    if not SNS_TOPIC_ARN:
+def send_alert(subject, message, ref=None):
+    """Publish an alert, or buffer it for the next digest in ALERT_MODE=digest.
+
+    Subjects outside ALERT_DIGEST_CATEGORIES are critical and published at once;
+    when the publish rate cap is exhausted they are buffered instead of dropped.
+    """
+    if alert_sink is None:
+        return
+    if ALERT_MODE != "digest":
+        alert_sink.publish(subject, message)
         return
-    sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject, Message=message)
+    if subject not in ALERT_DIGEST_CATEGORIES and alert_limiter.acquire():
+        alert_sink.publish(subject, message)
+        return
+    alert_buffer.add(subject, {"subject": subject, "message": message, "ref": ref,
+                               "origin": "lambda", "created_at": now_ts()})
 
 
 
-# Lambda handler
+# Alerting
+#
+# In ALERT_MODE=digest routine alerts (one per file) are written to a buffer
+# under alerts/pending/<CATEGORY>/ - by this Lambda and by the Glue ETL job
+# (--alert_mode digest) - instead of being published one by one. A scheduled
+# invocation of this Lambda (EventBridge, {"alert_flush": true}) publishes one
+# digest per category once it holds ALERT_DIGEST_MAX_COUNT alerts or its oldest
+# alert is ALERT_DIGEST_MAX_AGE_SECONDS old. Flushing only from the schedule
+# keeps a single flusher, so a digest is never sent twice by racing containers.
+# All publishes go through a token bucket capped at ALERT_MAX_PER_MINUTE.
 
-def lambda_handler(event, context):
-    logger.info("Event: %s", json.dumps(event))
+class SNSAlertSink:
+    def publish(self, subject, message):
+        # SNS subjects are limited to 100 characters, messages to 256 KB
+        sns.publish(TopicArn=SNS_TOPIC_ARN, Subject=subject[:100], Message=message[:250000])
+
+
+class LocalAlertSink:
+    """Collects published alerts in memory (tests / local runs)."""
+
+    def __init__(self):
+        self.published = []
+        self.lock = threading.Lock()
+
+    def publish(self, subject, message):
+        logger.info("ALERT %s: %s", subject, message)
+        with self.lock:
+            self.published.append({"subject": subject, "message": message, "at": time.time()})
+
+
+class AlertRateLimiter:
+    """Token bucket: bursts up to per_minute publishes, refilled at per_minute / 60 per second."""
+
+    def __init__(self, per_minute=ALERT_MAX_PER_MINUTE):
+        self.capacity = float(per_minute)
+        self.tokens = float(per_minute)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.capacity / 60.0)
+            self.updated = now
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+def alert_category_slug(category):
+    return category.replace(" ", "_")
+
+
+class MemoryAlertBuffer:
+    """Per-process buffer (tests / local runs)."""
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def add(self, category, alert):
+        with self.lock:
+            self.items.setdefault(category, []).append((gen_uuid(), time.time(), alert))
+
+    def categories(self):
+        with self.lock:
+            return [c for c, items in self.items.items() if items]
+
+    def pending(self, category):
+        with self.lock:
+            return [(item_id, created) for item_id, created, _ in self.items.get(category, [])]
+
+    def read(self, category, item_ids):
+        wanted = set(item_ids)
+        with self.lock:
+            return [a for item_id, _, a in self.items.get(category, []) if item_id in wanted]
+
+    def delete(self, category, item_ids):
+        done = set(item_ids)
+        with self.lock:
+            self.items[category] = [i for i in self.items.get(category, []) if i[0] not in done]
+
+
+class S3AlertBuffer:
+    """Shared buffer: one small JSON object per alert under <prefix>pending/<CATEGORY>/."""
+
+    def __init__(self, bucket, prefix=ALERT_PREFIX):
+        self.bucket = bucket
+        self.pending_prefix = f"{prefix}pending/"
+
+    def add(self, category, alert):
+        key = f"{self.pending_prefix}{alert_category_slug(category)}/{now_ts()}_{gen_uuid()}.json"
+        s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(alert).encode("utf-8"))
+
+    def categories(self):
+        resp = s3.list_objects_v2(Bucket=self.bucket, Prefix=self.pending_prefix, Delimiter="/")
+        return [p["Prefix"][len(self.pending_prefix):].rstrip("/").replace("_", " ")
+                for p in resp.get("CommonPrefixes", [])]
+
+    def pending(self, category):
+        items = []
+        paginator = s3.get_paginator("list_objects_v2")
+        prefix = f"{self.pending_prefix}{alert_category_slug(category)}/"
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            items.extend((o["Key"], o["LastModified"].timestamp()) for o in page.get("Contents", []))
+        return items
+
+    def _get(self, key):
+        try:
+            return json.loads(s3.get_object(Bucket=self.bucket, Key=key)["Body"].read())
+        except Exception as exc:
+            return {"subject": key, "message": f"unreadable alert: {exc}", "ref": key}
+
+    def read(self, category, item_ids):
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            return list(pool.map(self._get, item_ids))
+
+    def delete(self, category, item_ids):
+        item_ids = list(item_ids)
+        for i in range(0, len(item_ids), 1000):
+            s3.delete_objects(Bucket=self.bucket, Delete={
+                "Objects": [{"Key": k} for k in item_ids[i:i + 1000]], "Quiet": True})
+
+
+def build_alert_digest(category, alerts, total, first_ts, last_ts):
+    """Render buffered alerts as one message: counts per distinct message,
+    summed metrics (e.g. DQ row counts) and the most recent alerts."""
+    by_message = {}
+    metrics = {}
+    for a in alerts:
+        text = str(a.get("message", "")).strip().splitlines()
+        text = text[0][:200] if text else ""
+        by_message[text] = by_message.get(text, 0) + 1
+        for name, value in (a.get("metrics") or {}).items():
+            if isinstance(value, (int, float)):
+                metrics[name] = metrics.get(name, 0) + value
+
+    first = datetime.utcfromtimestamp(first_ts).strftime("%Y-%m-%dT%H:%M:%SZ")
+    last = datetime.utcfromtimestamp(last_ts).strftime("%Y-%m-%dT%H:%M:%SZ")
+    lines = [f"{total} {category} alerts between {first} and {last}"]
+    if len(alerts) < total:
+        lines.append(f"(summary below covers {len(alerts)} of them)")
+
+    if metrics:
+        lines += ["", "Totals:"]
+        lines += [f"  {name}: {value}" for name, value in sorted(metrics.items())]
+
+    if not metrics or len(by_message) <= ALERT_DIGEST_DETAIL_LINES:
+        lines += ["", "By message:"]
+        ranked = sorted(by_message.items(), key=lambda kv: -kv[1])[:ALERT_DIGEST_DETAIL_LINES]
+        lines += [f"  {count:>6}  {text}" for text, count in ranked]
 
+    recent = sorted(alerts, key=lambda a: a.get("created_at", ""), reverse=True)[:ALERT_DIGEST_DETAIL_LINES]
+    lines += ["", f"Most recent ({len(recent)}):"]
+    for a in recent:
+        ref = a.get("ref") or a.get("origin", "")
+        text = str(a.get("message", "")).strip().splitlines()
+        lines.append(f"  {a.get('created_at', '')}  {ref}  {text[0][:200] if text else ''}")
+
+    return f"[DIGEST] {category} x{total}", "\n".join(lines)
+
+
+def flush_alert_digests(force=False):
+    """Publish one digest per due category and drop the alerts it covers."""
+    if alert_buffer is None or alert_sink is None:
+        return {"digests": 0, "alerts": 0, "deferred": []}
+
+    now = time.time()
+    digests, flushed, deferred = 0, 0, []
+    for category in alert_buffer.categories():
+        items = alert_buffer.pending(category)
+        if not items:
+            continue
+        created = [c for _, c in items]
+        # Critical alerts only land here when the rate cap was hit: always due
+        due = (force or category not in ALERT_DIGEST_CATEGORIES
+               or len(items) >= ALERT_DIGEST_MAX_COUNT
+               or now - min(created) >= ALERT_DIGEST_MAX_AGE_SECONDS)
+        if not due:
+            continue
+        if not alert_limiter.acquire():
+            deferred.append(category)
+            continue
+
+        item_ids = [i for i, _ in items]
+        alerts = alert_buffer.read(category, item_ids[:ALERT_DIGEST_READ_LIMIT])
+        subject, message = build_alert_digest(category, alerts, len(items), min(created), max(created))
+        alert_sink.publish(subject, message)
+        # Publish before delete: a failed delete repeats a digest, it never loses one
+        alert_buffer.delete(category, item_ids)
+        digests += 1
+        flushed += len(items)
+
+    if deferred:
+        logger.info("Alert digests deferred by rate cap: %s", deferred)
+    return {"digests": digests, "alerts": flushed, "deferred": deferred}
+
+
+def build_alert_sink():
+    if ALERT_SINK == "local":
+        return LocalAlertSink()
+    return SNSAlertSink() if SNS_TOPIC_ARN else None
+
+
+def build_alert_buffer():
+    if ALERT_MODE != "digest":
+        return None
+    if ALERT_BUFFER == "memory":
+        return MemoryAlertBuffer()
+    return S3AlertBuffer(BUCKET)
+
+
+alert_sink = build_alert_sink()
+alert_buffer = build_alert_buffer()
+alert_limiter = AlertRateLimiter()
+
+
+
+# Idempotency
+#
+# S3 notifications are at-least-once. Every record is claimed in a store keyed on
+# bucket/key/ETag/sequencer before any S3 mutation; a record whose claim already
+# exists (and has not expired) is a redelivery and is skipped.
+
+def idempotency_token(bucket, key, s3_info):
+    obj = s3_info.get("object", {})
+    return f"{bucket}/{key}#{obj.get('eTag', '')}#{obj.get('sequencer', '')}"
+
+
+class MemoryIdempotencyStore:
+    """Claims held in process memory; dedupes redeliveries hitting the same warm container."""
+
+    def __init__(self, ttl_seconds=IDEMPOTENCY_TTL_SECONDS):
+        self.ttl_seconds = ttl_seconds
+        self.claims = {}
+        self.lock = threading.Lock()
+
+    def _prune(self, now):
+        for token in [t for t, exp in self.claims.items() if exp <= now]:
+            del self.claims[token]
+
+    def claim(self, token):
+        now = time.time()
+        with self.lock:
+            self._prune(now)
+            if token in self.claims:
+                return False
+            self.claims[token] = now + self.ttl_seconds
+            return True
+
+    def release(self, token):
+        with self.lock:
+            self.claims.pop(token, None)
+
+
+class FileIdempotencyStore(MemoryIdempotencyStore):
+    """Claims persisted to a local JSON file (tests, local runs, /tmp across warm invocations)."""
+
+    def __init__(self, path=IDEMPOTENCY_FILE, ttl_seconds=IDEMPOTENCY_TTL_SECONDS):
+        super().__init__(ttl_seconds)
+        self.path = path
+        try:
+            with open(path) as fh:
+                self.claims = json.load(fh)
+        except (OSError, ValueError):
+            self.claims = {}
+
+    def _save(self):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as fh:
+            json.dump(self.claims, fh)
+        os.replace(tmp, self.path)
+
+    def claim(self, token):
+        claimed = super().claim(token)
+        if claimed:
+            with self.lock:
+                self._save()
+        return claimed
+
+    def release(self, token):
+        super().release(token)
+        with self.lock:
+            self._save()
+
+
+class DynamoDBIdempotencyStore:
+    """Claims in a DynamoDB table (partition key `pk`, TTL attribute `expires_at`).
+
+    The conditional put makes the claim atomic across concurrent invocations;
+    expired items are treated as absent even before DynamoDB TTL removes them.
+    """
+
+    def __init__(self, table_name, ttl_seconds=IDEMPOTENCY_TTL_SECONDS, client=None):
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+        self.client = client or LazyClient("dynamodb", Config(
+            connect_timeout=AWS_CONNECT_TIMEOUT, read_timeout=5,
+            retries={"max_attempts": 3, "mode": "standard"}))
+
+    def claim(self, token):
+        now = int(time.time())
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={"pk": {"S": token}, "expires_at": {"N": str(now + self.ttl_seconds)}},
+                ConditionExpression="attribute_not_exists(pk) OR expires_at < :now",
+                ExpressionAttributeValues={":now": {"N": str(now)}},
+            )
+            return True
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") == "ConditionalCheckFailedException":
+                return False
+            raise
+
+    def release(self, token):
+        self.client.delete_item(TableName=self.table_name, Key={"pk": {"S": token}})
+
+
+def build_idempotency_store():
+    if IDEMPOTENCY_STORE == "dynamodb":
+        if not IDEMPOTENCY_TABLE:
+            raise ValueError("IDEMPOTENCY_STORE=dynamodb requires IDEMPOTENCY_TABLE")
+        return DynamoDBIdempotencyStore(IDEMPOTENCY_TABLE)
+    if IDEMPOTENCY_STORE == "file":
+        return FileIdempotencyStore()
+    if IDEMPOTENCY_STORE == "memory":
+        return MemoryIdempotencyStore()
+    return None
+
+
+idempotency_store = build_idempotency_store()
+
+
+
+# Large-file splitting
+#
+# Oversized files are broken into header-preserving, line-aligned chunks under
+# validated/<validated_name>/part-NNNNN.csv. Spark skips the "_manifest.json"
+# next to them, and one Glue run processes the whole prefix with a single
+# ingest_run_id / source_file, so downstream the chunks stay one logical file.
+
+def object_size(bucket, key):
+    return s3.head_object(Bucket=bucket, Key=key)["ContentLength"]
+
+
+def read_range(bucket, key, start, end):
+    """Read bytes [start, end) of an object."""
+    resp = s3.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end - 1}")
+    return resp["Body"].read()
+
+
+class MultipartWriter:
+    """Stream bytes into a single S3 object using a multipart upload.
+
+    Parts are uploaded once SPLIT_PART_BYTES are buffered; when an executor is
+    given, uploads run on it with at most SPLIT_MAX_WORKERS parts in flight.
+    """
+
+    def __init__(self, bucket, key, executor=None):
+        self.bucket = bucket
+        self.key = key
+        self.executor = executor
+        self.upload_id = s3.create_multipart_upload(Bucket=bucket, Key=key)["UploadId"]
+        self.buffer = bytearray()
+        self.parts = []
+        self.pending = []
+        self.bytes_written = 0
+
+    def write(self, data):
+        self.buffer += data
+        self.bytes_written += len(data)
+        while len(self.buffer) >= SPLIT_PART_BYTES:
+            self._flush(SPLIT_PART_BYTES)
+
+    def _upload(self, part_number, body):
+        resp = s3.upload_part(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            PartNumber=part_number, Body=body
+        )
+        return {"PartNumber": part_number, "ETag": resp["ETag"]}
+
+    def _flush(self, num_bytes):
+        body = bytes(self.buffer[:num_bytes])
+        del self.buffer[:num_bytes]
+        part_number = len(self.parts) + len(self.pending) + 1
+        if self.executor is None:
+            self.parts.append(self._upload(part_number, body))
+            return
+        if len(self.pending) >= SPLIT_MAX_WORKERS:
+            self.parts.append(self.pending.pop(0).result())
+        self.pending.append(self.executor.submit(self._upload, part_number, body))
+
+    def close(self):
+        if self.buffer or not (self.parts or self.pending):
+            self._flush(len(self.buffer))
+        self.parts.extend(f.result() for f in self.pending)
+        self.pending = []
+        s3.complete_multipart_upload(
+            Bucket=self.bucket, Key=self.key, UploadId=self.upload_id,
+            MultipartUpload={"Parts": sorted(self.parts, key=lambda p: p["PartNumber"])}
+        )
+
+    def abort(self):
+        for f in self.pending:
+            f.cancel()
+        try:
+            s3.abort_multipart_upload(Bucket=self.bucket, Key=self.key, UploadId=self.upload_id)
+        except ClientError:
+            logger.warning("Failed to abort multipart upload for %s", self.key)
+
+
+def next_line_start(bucket, key, offset, size):
+    """Return the offset just after the first newline at or past `offset`."""
+    pos = offset
+    while pos < size:
+        probe = read_range(bucket, key, pos, min(pos + SPLIT_PROBE_BYTES, size))
+        idx = probe.find(b"\n")
+        if idx != -1:
+            return pos + idx + 1
+        pos += len(probe)
+    return size
+
+
+def chunk_key(chunk_prefix, index):
+    return f"{chunk_prefix}part-{index:05d}.csv"
+
+
+def copy_range_as_chunk(bucket, src_key, dst_key, start, end, header):
+    writer = MultipartWriter(bucket, dst_key)
     try:
-        for record in event.get("Records", []):
-            s3_info = record.get("s3", {})
-            bucket = s3_info.get("bucket", {}).get("name")
-            key = unquote_plus(s3_info.get("object", {}).get("key"))
+        if start > 0:
+            writer.write(header)
+        pos = start
+        while pos < end:
+            stop = min(pos + SPLIT_PART_BYTES, end)
+            writer.write(read_range(bucket, src_key, pos, stop))
+            pos = stop
+        writer.close()
+    except Exception:
+        writer.abort()
+        raise
+    return {"key": dst_key, "bytes": writer.bytes_written, "source_range": [start, end]}
 
-            if bucket != BUCKET or not key.startswith(RAW_PREFIX):
-                continue
 
-            orig_name = basename(key)
-            ingest_run_id = gen_uuid()
+def split_plain_object(bucket, src_key, chunk_prefix, size, header, executor):
+    # Chunk boundaries are independent of each other, so probe them in parallel
+    offsets = list(range(SPLIT_CHUNK_BYTES, size, SPLIT_CHUNK_BYTES))
+    starts = list(executor.map(lambda o: next_line_start(bucket, src_key, o, size), offsets))
+    bounds = sorted(set([0] + [b for b in starts if b < size]))
+    ranges = list(zip(bounds, bounds[1:] + [size]))
 
-            validated_name = name_with_option_c(orig_name, "validated")
-            structural_name = name_with_option_c(orig_name, "structural")
-            archive_raw_name = name_with_option_c(orig_name, "archived_raw")
+    futures = [
+        executor.submit(copy_range_as_chunk, bucket, src_key, chunk_key(chunk_prefix, i), start, end, header)
+        for i, (start, end) in enumerate(ranges)
+    ]
+    return [f.result() for f in futures]
 
-            archive_raw_key = f"{ARCHIVE_PREFIX}raw/{archive_raw_name}"
-            move_s3_object(bucket, key, archive_raw_key)
 
-            sample = read_object_head(bucket, archive_raw_key)
-            if not sample:
-                dst = f"{SYSTEM_REJECT_PREFIX}{structural_name}"
-                move_s3_object(bucket, archive_raw_key, dst)
-                write_reason_json(bucket, dst + "_reason.json", {"file": archive_raw_key})
-                send_alert("SYSTEM ERROR", archive_raw_key)
-                continue
+def iter_gzip_blocks(bucket, key, size, executor):
+    """Yield decompressed blocks of a (possibly multi-member) gzip object.
 
-            delimiter, header = detect_delimiter_and_header(sample)
+    Compressed ranges are prefetched one ahead while the current one is inflated.
+    """
+    decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    ranges = [(p, min(p + SPLIT_PART_BYTES, size)) for p in range(0, size, SPLIT_PART_BYTES)]
+    nxt = executor.submit(read_range, bucket, key, *ranges[0]) if ranges else None
+    for i in range(len(ranges)):
+        data = nxt.result()
+        nxt = executor.submit(read_range, bucket, key, *ranges[i + 1]) if i + 1 < len(ranges) else None
+        # Output is capped per call, so keep calling (with an empty input once the
+        # range is consumed) until the decompressor has nothing buffered.
+        while True:
+            out = decomp.decompress(data, SPLIT_PART_BYTES)
+            if out:
+                yield out
+            if decomp.eof:
+                data = decomp.unused_data
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                if not data:
+                    break
+            else:
+                data = decomp.unconsumed_tail
+                if not data and not out:
+                    break
+    tail = decomp.flush()
+    if tail:
+        yield tail
 
-            structural_errors = []
-            if delimiter is None:
-                structural_errors.append("delimiter_detection_failed")
-            missing = [c for c in REQUIRED_COLUMNS if c not in header]
-            if missing:
-                structural_errors.append(f"missing_columns:{missing}")
 
-            if structural_errors:
-                dst = f"{STRUCTURAL_REJECT_PREFIX}{structural_name}"
-                move_s3_object(bucket, archive_raw_key, dst)
-                write_reason_json(bucket, dst + "_reason.json", {"errors": structural_errors})
-                send_alert("STRUCTURAL REJECT", json.dumps(structural_errors))
+def split_gzip_object(bucket, src_key, chunk_prefix, size, executor):
+    chunks = []
+    header = None
+    writer = None
+    pending = b""
+
+    def finish(w):
+        w.close()
+        chunks.append({"key": w.key, "bytes": w.bytes_written})
+
+    try:
+        for block in iter_gzip_blocks(bucket, src_key, size, executor):
+            pending += block
+            if header is None:
+                idx = pending.find(b"\n")
+                if idx == -1:
+                    continue
+                header = pending[:idx + 1]
+            if writer is None:
+                writer = MultipartWriter(bucket, chunk_key(chunk_prefix, len(chunks)), executor)
+                if chunks:
+                    writer.write(header)
+            if writer.bytes_written + len(pending) < SPLIT_CHUNK_BYTES:
+                writer.write(pending)
+                pending = b""
+                continue
+            cut = pending.rfind(b"\n")
+            if cut == -1:
+                writer.write(pending)
+                pending = b""
                 continue
+            writer.write(pending[:cut + 1])
+            pending = pending[cut + 1:]
+            finish(writer)
+            writer = None
+        if pending:
+            if writer is None:
+                writer = MultipartWriter(bucket, chunk_key(chunk_prefix, len(chunks)), executor)
+                if chunks:
+                    writer.write(header or b"")
+            writer.write(pending)
+        if writer is not None:
+            finish(writer)
+    except Exception:
+        if writer is not None:
+            writer.abort()
+        raise
+    return chunks
+
+
+def split_object(bucket, src_key, chunk_prefix, size, sample, ingest_run_id, source_file):
+    """Split src_key into line-aligned chunks under chunk_prefix and write a manifest."""
+    gz = is_gzip(src_key, read_range(bucket, src_key, 0, min(2, size)))
+    with ThreadPoolExecutor(max_workers=SPLIT_MAX_WORKERS) as executor:
+        if gz:
+            chunks = split_gzip_object(bucket, src_key, chunk_prefix, size, executor)
+        else:
+            first_nl = sample.find(b"\n")
+            header = sample[:first_nl + 1] if first_nl != -1 else sample + b"\n"
+            chunks = split_plain_object(bucket, src_key, chunk_prefix, size, header, executor)
+
+    manifest = {
+        "ingest_run_id": ingest_run_id,
+        "source_file": source_file,
+        "source_key": src_key,
+        "source_bytes": size,
+        "gzip": gz,
+        "chunks": chunks,
+    }
+    write_reason_json(bucket, f"{chunk_prefix}_manifest.json", manifest)
+    logger.info("SPLIT %s into %d chunks under %s", src_key, len(chunks), chunk_prefix)
+    return chunks
+
+
+
+# Streaming pre-validation
+#
+# The head sample only proves the header is usable. With STREAM_VALIDATION the
+# whole object is read in STREAM_BLOCK_BYTES ranges (next range prefetched, gzip
+# inflated on the fly) and checked line by line, the way the ETL will split it:
+# field count against the header, UTF-8 decoding, stray CR / NUL bytes and line
+# termination. Only the current partial line is buffered, so memory stays
+# constant. The scan stops as soon as the error-row rate exceeds
+# STREAM_MAX_ERROR_RATE (after STREAM_MIN_ROWS rows) and the file is rejected
+# with row numbers and byte offsets of the first problems in its reason JSON.
+
+def iter_ranges(bucket, key, size, block_bytes, executor):
+    """Yield (start, bytes) for consecutive ranges of an object, prefetching one ahead."""
+    starts = list(range(0, size, block_bytes))
+    nxt = executor.submit(read_range, bucket, key, 0, min(block_bytes, size)) if starts else None
+    for i, start in enumerate(starts):
+        data = nxt.result()
+        if i + 1 < len(starts):
+            end = min(starts[i + 1] + block_bytes, size)
+            nxt = executor.submit(read_range, bucket, key, starts[i + 1], end)
+        yield start, data
+
+
+class StreamValidator:
+    """Line checks over a byte stream fed in arbitrary blocks.
+
+    Offsets are byte positions in the (uncompressed) stream; rows are data rows
+    counted from 1 after the header, blank lines skipped like the ETL does.
+    """
+
+    FATAL = ("line_too_long", "truncated_gzip", "gzip_error", "no_header", "truncated_last_line")
+
+    def __init__(self, delimiter):
+        self.delim = delimiter.encode("utf-8")
+        self.header = None
+        self.expected_fields = None
+        self.terminator = None
+        self.rows = 0
+        self.error_rows = 0
+        self.offset = 0
+        self.pending = b""
+        self.counts = {}
+        self.problems = []
+        self.stopped = None
+
+    def problem(self, check, offset, detail, row=None):
+        self.counts[check] = self.counts.get(check, 0) + 1
+        if len(self.problems) < STREAM_MAX_PROBLEMS:
+            self.problems.append({"check": check, "row": row, "offset": offset, "detail": detail})
+        if check in self.FATAL:
+            self.stopped = check
+
+    def feed(self, data):
+        lines = (self.pending + data).split(b"\n")
+        self.pending = lines.pop()
+        for line in lines:
+            self.check_line(line, self.offset, terminated=True)
+            self.offset += len(line) + 1
+            if self.stopped:
+                return
+        if len(self.pending) > STREAM_MAX_LINE_BYTES:
+            self.problem("line_too_long", self.offset,
+                         f"no line break within {STREAM_MAX_LINE_BYTES} bytes", self.rows + 1)
+
+    def finish(self):
+        if self.pending and not self.stopped:
+            self.check_line(self.pending, self.offset, terminated=False)
+            self.offset += len(self.pending)
+            self.pending = b""
+        if self.expected_fields is None and not self.stopped:
+            self.problem("no_header", 0, "no non-empty line found")
+
+    def check_line(self, line, offset, terminated):
+        if terminated:
+            term = b"\r\n" if line.endswith(b"\r") else b"\n"
+            if term == b"\r\n":
+                line = line[:-1]
+            if self.terminator is None:
+                self.terminator = term
+            elif term != self.terminator:
+                self.problem("mixed_line_endings", offset, f"{term!r} after {self.terminator!r} lines", self.rows + 1)
+        if line.startswith(b"\xef\xbb\xbf"):
+            line = line[3:]
+        if not line.strip():
+            return
+
+        if self.header is None:
+            self.header = line
+            self.expected_fields = line.count(self.delim) + 1
+            return
+        if line == self.header:
+            # repeated header (concatenated / multi-member files): dropped by the ETL too
+            return
+
+        self.rows += 1
+        errors = 0
+        if b"\r" in line:
+            errors += 1
+            self.problem("bare_cr", offset + line.index(b"\r"), "carriage return inside a line", self.rows)
+        if b"\x00" in line:
+            errors += 1
+            self.problem("nul_byte", offset + line.index(b"\x00"), "NUL byte (UTF-16 or binary data?)", self.rows)
+        try:
+            line.decode("utf-8")
+        except UnicodeDecodeError as e:
+            errors += 1
+            self.problem("encoding", offset + e.start, f"invalid UTF-8 byte 0x{line[e.start]:02x}", self.rows)
+        fields = line.count(self.delim) + 1
+        if fields != self.expected_fields:
+            errors += 1
+            if terminated:
+                self.problem("field_count", offset, f"expected {self.expected_fields} fields, got {fields}", self.rows)
+            else:
+                # a short unterminated last line means the body was cut off
+                self.problem("truncated_last_line", offset,
+                             f"unterminated last line has {fields} of {self.expected_fields} fields", self.rows)
+
+        if errors:
+            self.error_rows += 1
+            if self.rows >= STREAM_MIN_ROWS and self.error_rows > STREAM_MAX_ERROR_RATE * self.rows:
+                self.stopped = "error_rate"
+
+    def report(self, size, bytes_scanned, gzip_input):
+        rate = self.error_rows / self.rows if self.rows else 0.0
+        reason = None
+        if self.stopped == "error_rate":
+            reason = f"error rate {rate:.1%} > {STREAM_MAX_ERROR_RATE:.1%} after {self.rows} rows"
+        elif self.stopped:
+            reason = self.stopped
+        elif self.rows and rate > STREAM_MAX_ERROR_RATE:
+            reason = f"error rate {rate:.1%} > {STREAM_MAX_ERROR_RATE:.1%}"
+        return {
+            "rejected": reason is not None,
+            "reason": reason,
+            "rows": self.rows,
+            "error_rows": self.error_rows,
+            "error_rate": round(rate, 6),
+            "expected_fields": self.expected_fields,
+            "line_terminator": {b"\n": "LF", b"\r\n": "CRLF"}.get(self.terminator),
+            "object_bytes": size,
+            "bytes_scanned": bytes_scanned,
+            "stream_bytes": self.offset,
+            "gzip": gzip_input,
+            "stopped_early": bytes_scanned < size,
+            "problem_counts": self.counts,
+            "problems": self.problems,
+        }
+
 
-            validated_key = f"{VALIDATED_PREFIX}{validated_name}"
-            move_s3_object(bucket, archive_raw_key, validated_key)
+def stream_validate(bucket, key, delimiter):
+    size = object_size(bucket, key)
+    validator = StreamValidator(delimiter)
+    gzip_input = None
+    decomp = None
+    member_open = False   # inside a gzip member whose trailer has not been seen
+    scanned = 0
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        for start, data in iter_ranges(bucket, key, size, STREAM_BLOCK_BYTES, executor):
+            scanned = start + len(data)
+            if gzip_input is None:
+                gzip_input = is_gzip(key, data)
+                decomp = zlib.decompressobj(16 + zlib.MAX_WBITS) if gzip_input else None
+            if not gzip_input:
+                validator.feed(data)
+            else:
+                try:
+                    # Drain capped output until the decompressor has nothing buffered
+                    while not validator.stopped:
+                        member_open = True
+                        out = decomp.decompress(data, STREAM_BLOCK_BYTES)
+                        validator.feed(out)
+                        if decomp.eof:
+                            # multi-member gzip: continue with the next member
+                            member_open = False
+                            data = decomp.unused_data
+                            decomp = zlib.decompressobj(16 + zlib.MAX_WBITS)
+                            if not data:
+                                break
+                        else:
+                            data = decomp.unconsumed_tail
+                            if not data and not out:
+                                break
+                except zlib.error as e:
+                    validator.problem("gzip_error", validator.offset, str(e))
+            if validator.stopped:
+                break
 
-            # FIXED HERE → pass validated_key to Glue, NOT raw key
-            glue_args = {
-                "--s3_input_path": f"s3://{bucket}/{validated_key}",
-                "--s3_output_path": f"s3://{bucket}/processed/",
-                "--ingest_run_id": ingest_run_id,
-                "--source_file": validated_name,
-                "--original_key": validated_key,          
-                "--sns_topic_arn": SNS_TOPIC_ARN          
-            }
+    if gzip_input and member_open and not validator.stopped:
+        validator.feed(decomp.flush())
+        validator.problem("truncated_gzip", validator.offset, "gzip stream ends before its trailer")
+    validator.finish()
+    return validator.report(size, scanned, bool(gzip_input))
 
+
+
+# Glue submission cap
+#
+# MAX_INFLIGHT_GLUE_RUNS caps concurrently running ETL job runs across all
+# concurrent invocations. "Count running runs, then start one" happens under a
+# global lock (a DynamoDB lease item), right before start_job_run, so only files
+# that passed validation take a slot. A validated file that finds no free slot
+# stays in validated/ and its Glue arguments are parked under GLUE_PENDING_PREFIX;
+# its record still succeeds, so deferrals never use up SQS receive attempts.
+# Parked runs are started oldest first at the start of every invocation and by
+# the scheduled {"glue_drain": true} event.
+
+class LocalSubmissionLock:
+    """Process lock; only a global cap while a single container submits (tests / local runs)."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+
+    def acquire(self, wait_seconds=GLUE_SUBMIT_LOCK_WAIT_SECONDS):
+        return "local" if self.lock.acquire(timeout=wait_seconds) else None
+
+    def release(self, token):
+        self.lock.release()
+
+
+class DynamoDBSubmissionLock:
+    """Lease item in a DynamoDB table (same `pk` / `expires_at` layout as the idempotency table).
+
+    The conditional put admits one holder across all invocations; the lease of a
+    crashed holder expires after GLUE_SUBMIT_LOCK_LEASE_SECONDS.
+    """
+
+    def __init__(self, table_name, name, lease_seconds=GLUE_SUBMIT_LOCK_LEASE_SECONDS, client=None):
+        self.table_name = table_name
+        self.pk = f"lock#{name}"
+        self.lease_seconds = lease_seconds
+        self.client = client or LazyClient("dynamodb", Config(
+            connect_timeout=AWS_CONNECT_TIMEOUT, read_timeout=5,
+            retries={"max_attempts": 3, "mode": "standard"}))
+
+    def acquire(self, wait_seconds=GLUE_SUBMIT_LOCK_WAIT_SECONDS):
+        owner = gen_uuid()
+        deadline = time.time() + wait_seconds
+        while True:
+            now = int(time.time())
             try:
-                glue.start_job_run(JobName=GLUE_JOB_NAME, Arguments=glue_args)
-            except Exception as e:
-                sys_key = f"{SYSTEM_REJECT_PREFIX}{validated_name}"
-                move_s3_object(bucket, validated_key, sys_key)
-                write_reason_json(bucket, sys_key + "_reason.json", {"error": str(e)})
-                send_alert("GLUE START FAILURE", str(e))
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={"pk": {"S": self.pk}, "owner": {"S": owner},
+                          "expires_at": {"N": str(now + self.lease_seconds)}},
+                    ConditionExpression="attribute_not_exists(pk) OR expires_at < :now",
+                    ExpressionAttributeValues={":now": {"N": str(now)}},
+                )
+                return owner
+            except ClientError as e:
+                if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                    raise
+            if time.time() >= deadline:
+                return None
+            time.sleep(0.2)
+
+    def release(self, token):
+        try:
+            self.client.delete_item(
+                TableName=self.table_name, Key={"pk": {"S": self.pk}},
+                ConditionExpression="#owner = :owner",
+                ExpressionAttributeNames={"#owner": "owner"},
+                ExpressionAttributeValues={":owner": {"S": token}},
+            )
+        except ClientError as e:
+            # Lease expired and was taken over: nothing left to release
+            if e.response.get("Error", {}).get("Code") != "ConditionalCheckFailedException":
+                raise
+
+
+def running_glue_runs():
+    resp = glue.get_job_runs(JobName=GLUE_JOB_NAME, MaxResults=200)
+    return sum(1 for r in resp.get("JobRuns", []) if r.get("JobRunState") in ("STARTING", "RUNNING", "WAITING"))
+
+
+def reject_unsubmitted(bucket, glue_args, error, ref):
+    """Move a validated file whose Glue run could not be started to rejected/system/."""
+    validated_key = glue_args["--original_key"]
+    sys_key = f"{SYSTEM_REJECT_PREFIX}{glue_args['--source_file']}"
+    if validated_key.endswith("/"):
+        move_s3_prefix(bucket, validated_key, f"{sys_key}/")
+    else:
+        move_s3_object(bucket, validated_key, sys_key)
+    write_reason_json(bucket, sys_key + "_reason.json", {"error": str(error)})
+    send_alert("GLUE START FAILURE", str(error), ref=ref)
+
+
+class GlueSubmissionGate:
+    """Starts ETL runs while fewer than `limit` are running; parks the rest in S3."""
+
+    def __init__(self, lock, limit, bucket, prefix=GLUE_PENDING_PREFIX):
+        self.lock = lock
+        self.limit = limit
+        self.bucket = bucket
+        self.prefix = prefix
+
+    def _slot_free(self):
+        """True while fewer than `limit` runs are running. A failed count (e.g. a
+        throttled get_job_runs) counts as no free slot, so the file stays parked."""
+        try:
+            return running_glue_runs() < self.limit
+        except Exception as e:
+            logger.warning("Counting running Glue runs failed, treating as no free slot: %s", e)
+            return False
+
+    def _start(self, glue_args):
+        """Start one run if a slot is free (lock held). Returns False when at the cap.
+
+        Only start_job_run errors propagate; callers treat those as a reject.
+        """
+        if not self._slot_free():
+            return False
+        try:
+            glue.start_job_run(JobName=GLUE_JOB_NAME, Arguments=glue_args)
+        except glue.exceptions.ConcurrentRunsExceededException:
+            return False
+        return True
+
+    def submit(self, glue_args, ref):
+        """Start the run, or park it when no slot is free. Returns True when started."""
+        token = self.lock.acquire()
+        if token is not None:
+            try:
+                if self._start(glue_args):
+                    return True
+            finally:
+                self.lock.release(token)
+        key = f"{self.prefix}{now_ts()}_{glue_args['--ingest_run_id']}.json"
+        s3.put_object(Bucket=self.bucket, Key=key, Body=json.dumps(
+            {"glue_args": glue_args, "ref": ref, "parked_at": now_ts()}).encode("utf-8"))
+        return False
+
+    def parked(self):
+        keys = []
+        paginator = s3.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            keys.extend(o["Key"] for o in page.get("Contents", []))
+        return sorted(keys)
+
+    def drain(self):
+        """Start parked runs, oldest first, while slots are free."""
+        keys = self.parked()
+        stats = {"started": 0, "failed": 0, "pending": len(keys)}
+        if not keys:
+            return stats
+        token = self.lock.acquire()
+        if token is None:
+            return stats
+        try:
+            for key in keys:
+                try:
+                    entry = json.loads(s3.get_object(Bucket=self.bucket, Key=key)["Body"].read())
+                except s3.exceptions.NoSuchKey:
+                    # Started by another invocation's drain before we got the lock
+                    stats["pending"] -= 1
+                    continue
+                try:
+                    if not self._start(entry["glue_args"]):
+                        break
+                    stats["started"] += 1
+                except Exception as e:
+                    reject_unsubmitted(self.bucket, entry["glue_args"], e, entry.get("ref"))
+                    stats["failed"] += 1
+                s3.delete_object(Bucket=self.bucket, Key=key)
+                stats["pending"] -= 1
+        finally:
+            self.lock.release(token)
+        return stats
+
+
+def build_glue_gate():
+    if MAX_INFLIGHT_GLUE_RUNS <= 0:
+        return None
+    if GLUE_SUBMIT_LOCK == "dynamodb":
+        if not GLUE_SUBMIT_LOCK_TABLE:
+            raise ValueError("GLUE_SUBMIT_LOCK=dynamodb requires GLUE_SUBMIT_LOCK_TABLE or IDEMPOTENCY_TABLE")
+        lock = DynamoDBSubmissionLock(GLUE_SUBMIT_LOCK_TABLE, f"glue-submit#{GLUE_JOB_NAME}")
+    else:
+        logger.warning("GLUE_SUBMIT_LOCK=memory: MAX_INFLIGHT_GLUE_RUNS is only enforced per container")
+        lock = LocalSubmissionLock()
+    return GlueSubmissionGate(lock, MAX_INFLIGHT_GLUE_RUNS, BUCKET)
+
+
+glue_gate = build_glue_gate()
+
+
+def drain_glue_runs():
+    if glue_gate is None:
+        return {"started": 0, "failed": 0, "pending": 0}
+    try:
+        stats = glue_gate.drain()
+    except Exception:
+        logger.exception("Draining parked Glue runs failed")
+        return {"started": 0, "failed": 0, "pending": None}
+    if stats["started"] or stats["pending"]:
+        logger.info("Parked Glue runs: %d started, %d failed, %d still pending",
+                    stats["started"], stats["failed"], stats["pending"])
+    return stats
+
+
+
+# SQS-sourced mode
+#
+# S3 notifications are delivered to an SQS queue and the Lambda receives large
+# batches of wrapped events. Messages are processed concurrently; failed ones are
+# returned in batchItemFailures so only they are retried.
+
+def is_sqs_event(event):
+    records = event.get("Records", [])
+    return bool(records) and records[0].get("eventSource") == "aws:sqs"
+
+
+def extract_s3_records(body):
+    """Unwrap an SQS message body: an S3 event, optionally inside an SNS envelope."""
+    payload = json.loads(body)
+    if payload.get("Type") == "Notification" and "Message" in payload:
+        payload = json.loads(payload["Message"])
+    # s3:TestEvent and other non-record payloads carry no Records
+    return payload.get("Records", [])
+
+
+def handle_sqs_batch(event):
+    messages = event.get("Records", [])
+
+    def process(message):
+        for s3_record in extract_s3_records(message["body"]):
+            handle_s3_record(s3_record)
+
+    failures, errors = [], []
+    with ThreadPoolExecutor(max_workers=SQS_MAX_WORKERS) as pool:
+        futures = [(pool.submit(process, m), m["messageId"]) for m in messages]
+        for future, message_id in futures:
+            try:
+                future.result()
+            except Exception as exc:
+                logger.exception("Failed SQS message %s", message_id)
+                errors.append(f"{message_id}: {exc}")
+                failures.append(message_id)
+
+    logger.info("SQS batch: %d messages, %d failed", len(messages), len(errors))
+    if errors:
+        send_alert("LAMBDA RECORD FAILURES", "\n".join(errors))
+    return {"batchItemFailures": [{"itemIdentifier": m} for m in failures]}
+
+
+class LocalSQSQueue:
+    """Offline stand-in for the SQS queue in front of the validator (tests / local runs).
+
+    drain() feeds batches to the handler the way the SQS event source mapping does:
+    messages listed in batchItemFailures are redelivered until max_receives, then
+    parked in dead_letters.
+    """
+
+    def __init__(self, batch_size=10, max_receives=5):
+        self.batch_size = batch_size
+        self.max_receives = max_receives
+        self.messages = deque()
+        self.dead_letters = []
+
+    def send(self, body):
+        if not isinstance(body, str):
+            body = json.dumps(body)
+        self.messages.append({"messageId": uuid.uuid4().hex, "body": body, "receiveCount": 0})
+
+    def send_s3_event(self, bucket, key, etag="", sequencer=""):
+        self.send({"Records": [{
+            "eventSource": "aws:s3",
+            "s3": {"bucket": {"name": bucket},
+                   "object": {"key": key, "eTag": etag, "sequencer": sequencer}},
+        }]})
+
+    def receive_batch(self):
+        batch = []
+        while self.messages and len(batch) < self.batch_size:
+            msg = self.messages.popleft()
+            msg["receiveCount"] += 1
+            batch.append(msg)
+        return batch
+
+    def drain(self, handler=None, context=None):
+        handler = handler or lambda_handler
+        stats = {"batches": 0, "delivered": 0, "redelivered": 0, "dead_lettered": 0}
+        while self.messages:
+            batch = self.receive_batch()
+            event = {"Records": [{
+                "messageId": m["messageId"], "body": m["body"], "eventSource": "aws:sqs",
+                "attributes": {"ApproximateReceiveCount": str(m["receiveCount"])},
+            } for m in batch]}
+            resp = handler(event, context) or {}
+            failed = {f["itemIdentifier"] for f in resp.get("batchItemFailures", [])}
+            stats["batches"] += 1
+            for msg in batch:
+                if msg["messageId"] not in failed:
+                    stats["delivered"] += 1
+                elif msg["receiveCount"] >= self.max_receives:
+                    self.dead_letters.append(msg)
+                    stats["dead_lettered"] += 1
+                else:
+                    self.messages.append(msg)
+                    stats["redelivered"] += 1
+        return stats
+
+
+
+# Lambda handler
+
+def lambda_handler(event, context):
+    logger.info("Event: %s", json.dumps(event))
+
+    if event.get("alert_flush"):
+        return flush_alert_digests(force=bool(event.get("force")))
+
+    # Parked runs take free slots before this invocation's new files
+    drained = drain_glue_runs()
+    if event.get("glue_drain"):
+        return drained
+
+    if is_sqs_event(event):
+        return handle_sqs_batch(event)
+
+    try:
+        for record in event.get("Records", []):
+            handle_s3_record(record)
 
     except Exception as exc:
         send_alert("LAMBDA FATAL ERROR", str(exc))
         raise
 
     return {"status": "ok"}
+
+
+def handle_s3_record(record):
+    s3_info = record.get("s3", {})
+    bucket = s3_info.get("bucket", {}).get("name")
+    key = unquote_plus(s3_info.get("object", {}).get("key"))
+
+    if bucket != BUCKET or not key.startswith(RAW_PREFIX):
+        return
+
+    token = idempotency_token(bucket, key, s3_info)
+    if idempotency_store is not None and not idempotency_store.claim(token):
+        logger.info("DUPLICATE event skipped: %s", token)
+        return
+
+    try:
+        route_object(bucket, key)
+    except Exception:
+        # Let a retried delivery of this record try again
+        if idempotency_store is not None:
+            idempotency_store.release(token)
+        raise
+
+
+def route_object(bucket, key):
+    """Validate one raw object and route it to validated/ (+ Glue) or rejected/."""
+    orig_name = basename(key)
+    ingest_run_id = gen_uuid()
+
+    validated_name = name_with_option_c(orig_name, "validated")
+    structural_name = name_with_option_c(orig_name, "structural")
+    archive_raw_name = name_with_option_c(orig_name, "archived_raw")
+
+    archive_raw_key = f"{ARCHIVE_PREFIX}raw/{archive_raw_name}"
+    move_s3_object(bucket, key, archive_raw_key)
+
+    sample, gzip_input = read_object_head(bucket, archive_raw_key)
+    if not sample:
+        dst = f"{SYSTEM_REJECT_PREFIX}{structural_name}"
+        move_s3_object(bucket, archive_raw_key, dst)
+        write_reason_json(bucket, dst + "_reason.json", {"file": archive_raw_key})
+        send_alert("SYSTEM ERROR", archive_raw_key)
+        return
+
+    delimiter, header = detect_delimiter_and_header(sample)
+
+    structural_errors = []
+    if delimiter is None:
+        structural_errors.append("delimiter_detection_failed")
+    missing = [c for c in REQUIRED_COLUMNS if c not in header]
+    if missing:
+        structural_errors.append(f"missing_columns:{missing}")
+
+    if structural_errors:
+        dst = f"{STRUCTURAL_REJECT_PREFIX}{structural_name}"
+        move_s3_object(bucket, archive_raw_key, dst)
+        write_reason_json(bucket, dst + "_reason.json", {"errors": structural_errors})
+        send_alert("STRUCTURAL REJECT", json.dumps(structural_errors), ref=key)
+        return
+
+    if STREAM_VALIDATION:
+        report = stream_validate(bucket, archive_raw_key, delimiter)
+        logger.info("STREAM VALIDATION %s: rows=%d error_rows=%d scanned=%d/%d reason=%s",
+                    archive_raw_key, report["rows"], report["error_rows"],
+                    report["bytes_scanned"], report["object_bytes"], report["reason"])
+        if report["rejected"]:
+            dst = f"{STRUCTURAL_REJECT_PREFIX}{structural_name}"
+            move_s3_object(bucket, archive_raw_key, dst)
+            write_reason_json(bucket, dst + "_reason.json",
+                              {"errors": [f"stream_validation_failed:{report['reason']}"],
+                               "stream_validation": report})
+            send_alert("STRUCTURAL REJECT", f"stream_validation_failed: {report['reason']}", ref=key)
+            return
+
+    validated_key = f"{VALIDATED_PREFIX}{validated_name}"
+    size = object_size(bucket, archive_raw_key) if SPLIT_THRESHOLD_BYTES > 0 else 0
+    split = size > SPLIT_THRESHOLD_BYTES > 0
+    if split:
+        # Validated input becomes a prefix of chunks; Glue reads it as one file
+        validated_key = f"{validated_key}/"
+        try:
+            split_object(bucket, archive_raw_key, validated_key, size, sample,
+                         ingest_run_id, validated_name)
+        except Exception as e:
+            sys_key = f"{SYSTEM_REJECT_PREFIX}{validated_name}"
+            move_s3_prefix(bucket, validated_key, f"{sys_key}/")
+            move_s3_object(bucket, archive_raw_key, sys_key)
+            write_reason_json(bucket, sys_key + "_reason.json", {"error": f"split_failed: {e}"})
+            send_alert("SYSTEM ERROR", f"split_failed: {archive_raw_key}: {e}")
+            return
+        s3.delete_object(Bucket=bucket, Key=archive_raw_key)
+    else:
+        if gzip_input and not validated_key.lower().endswith(".gz"):
+            # Spark picks the codec from the extension: without ".gz" a gzip body is read as text
+            validated_name = f"{validated_name}.gz"
+            validated_key = f"{validated_key}.gz"
+        move_s3_object(bucket, archive_raw_key, validated_key)
+
+    # FIXED HERE → pass validated_key to Glue, NOT raw key
+    glue_args = {
+        "--s3_input_path": f"s3://{bucket}/{validated_key}",
+        "--s3_output_path": f"s3://{bucket}/processed/",
+        "--ingest_run_id": ingest_run_id,
+        "--source_file": validated_name,
+        "--original_key": validated_key,          
+        "--sns_topic_arn": SNS_TOPIC_ARN,
+        "--alert_mode": ALERT_MODE,
+        "--alert_prefix": ALERT_PREFIX,
+    }
+
+    try:
+        if glue_gate is None:
+            glue.start_job_run(JobName=GLUE_JOB_NAME, Arguments=glue_args)
+        elif not glue_gate.submit(glue_args, ref=key):
+            logger.info("DEFERRED Glue run for %s: %d runs in flight", validated_key, MAX_INFLIGHT_GLUE_RUNS)
+    except Exception as e:
+        reject_unsubmitted(bucket, glue_args, e, key)